@@ -5,11 +5,23 @@
 #include <unistd.h>
 #include <pybind11/pybind11.h>
 
+#include <pybind11/stl.h>
+
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
 #include <fstream>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <utility>
+#include <vector>
 #include "common/proto/signature_info.pb.h"
 #include "interface/kv/kv_client.h"
 #include "platform/config/resdb_config_utils.h"
 
+namespace py = pybind11;
+
 using resdb::GenerateReplicaInfo;
 using resdb::GenerateResDBConfig;
 using resdb::KVClient;
@@ -17,6 +29,115 @@ using resdb::ReplicaInfo;
 using resdb::ResDBConfig;
 
 
+// A long-lived connection to the KV service. The config file is parsed once
+// and a small pool of KVClient instances is reused across calls, so each
+// get/set only pays for the request itself. A client is only ever used by
+// one thread at a time.
+class KVSession {
+ public:
+  KVSession(std::string config_path, int pool_size)
+      : config_(GenerateResDBConfig(config_path)) {
+    config_.SetClientTimeoutMs(100000);
+    if (pool_size < 1) {
+      pool_size = 1;
+    }
+    for (int i = 0; i < pool_size; ++i) {
+      clients_.push_back(std::make_unique<KVClient>(config_));
+      idle_.push_back(clients_.back().get());
+    }
+  }
+
+  std::string Get(std::string key) {
+    KVClient* client = Acquire();
+    auto result_ptr = client->Get(key);
+    Release(client);
+    if (result_ptr) {
+      return *result_ptr;
+    } else {
+      return "";
+    }
+  }
+
+  bool Set(std::string key, std::string value) {
+    KVClient* client = Acquire();
+    int result = client->Set(key, value);
+    Release(client);
+    return result == 0;
+  }
+
+  // Fetches every key, spreading the requests over all pooled clients so
+  // the batch costs about keys / pool_size round trips. Missing keys map to "".
+  std::vector<std::string> GetMany(std::vector<std::string> keys) {
+    std::vector<std::string> values(keys.size());
+    RunBatch(keys.size(), [&](KVClient* client, size_t i) {
+      auto result_ptr = client->Get(keys[i]);
+      if (result_ptr) {
+        values[i] = *result_ptr;
+      }
+    });
+    return values;
+  }
+
+  std::vector<bool> SetMany(
+      std::vector<std::pair<std::string, std::string>> items) {
+    std::vector<char> ok(items.size(), 0);
+    RunBatch(items.size(), [&](KVClient* client, size_t i) {
+      ok[i] = client->Set(items[i].first, items[i].second) == 0;
+    });
+    return std::vector<bool>(ok.begin(), ok.end());
+  }
+
+  int PoolSize() const { return clients_.size(); }
+
+ private:
+  // Runs op(client, i) for i in [0, n). Each worker thread holds one pooled
+  // client and pulls the next index until the batch is drained.
+  template <typename Op>
+  void RunBatch(size_t n, Op op) {
+    if (n == 0) {
+      return;
+    }
+    std::atomic<size_t> next(0);
+    auto worker = [&]() {
+      KVClient* client = Acquire();
+      for (size_t i = next++; i < n; i = next++) {
+        op(client, i);
+      }
+      Release(client);
+    };
+    size_t workers = std::min(n, clients_.size());
+    std::vector<std::thread> threads;
+    for (size_t i = 1; i < workers; ++i) {
+      threads.emplace_back(worker);
+    }
+    worker();
+    for (auto& t : threads) {
+      t.join();
+    }
+  }
+
+  KVClient* Acquire() {
+    std::unique_lock<std::mutex> lock(mutex_);
+    cv_.wait(lock, [this] { return !idle_.empty(); });
+    KVClient* client = idle_.back();
+    idle_.pop_back();
+    return client;
+  }
+
+  void Release(KVClient* client) {
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      idle_.push_back(client);
+    }
+    cv_.notify_one();
+  }
+
+  ResDBConfig config_;
+  std::vector<std::unique_ptr<KVClient>> clients_;
+  std::vector<KVClient*> idle_;
+  std::mutex mutex_;
+  std::condition_variable cv_;
+};
 
 
 std::string get(std::string key, std::string config_path) {
@@ -43,7 +164,20 @@ bool set(std::string key, std::string value, std::string config_path) {
     }
 }
 
+// Every call below blocks on the network, so the GIL is released while it
+// runs. Arguments are converted before the release and the return value
+// after it is re-acquired.
+using release_gil = py::call_guard<py::gil_scoped_release>;
+
 PYBIND11_MODULE(pybind_kv, m) {
-    m.def("get", &get, "A function that gets a value from the key-value store");
-    m.def("set", &set, "A function that sets a value in the key-value store");
-}
\ No newline at end of file
+    m.def("get", &get, "A function that gets a value from the key-value store", release_gil());
+    m.def("set", &set, "A function that sets a value in the key-value store", release_gil());
+
+    py::class_<KVSession>(m, "KVSession")
+        .def(py::init<std::string, int>(), py::arg("config_path"), py::arg("pool_size") = 4)
+        .def("get", &KVSession::Get, "Get a value using a pooled client", release_gil())
+        .def("set", &KVSession::Set, "Set a value using a pooled client", release_gil())
+        .def("get_many", &KVSession::GetMany, "Get many values in parallel over the client pool", release_gil())
+        .def("set_many", &KVSession::SetMany, "Set many key/value pairs in parallel over the client pool", release_gil())
+        .def_property_readonly("pool_size", &KVSession::PoolSize);
+}
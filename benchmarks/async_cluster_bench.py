@@ -0,0 +1,56 @@
+"""
+Compare a status fan-out over many CIDs through ipfs_cluster_async with the serial
+ipfs_cluster.get_file_status loop, against the local fake cluster of tests/fake_cluster.py.
+The fake cluster answers each request after --latency-ms, like a remote cluster would.
+The correctness of each call is covered by tests/test_ipfs_cluster_async.py.
+
+Run from the repository root:
+    python3 benchmarks/async_cluster_bench.py --cids 500 --latency-ms 20 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+sys.path.insert(0, os.path.abspath("tests"))
+import ipfs_cluster
+import ipfs_cluster_async
+from fake_cluster import FakeCluster, start_server
+
+
+async def fan_out(cluster, cids):
+    return await asyncio.gather(*(cluster.status(cid) for cid in cids))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cids", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    url = start_server(FakeCluster(args.latency_ms / 1000))
+    ipfs_cluster.ipfs_cluster_api_url = ipfs_cluster.ipfs_gateway_url = url
+    cids = [f"QmBench{i:040d}" for i in range(args.cids)]
+
+    async def run():
+        async with ipfs_cluster_async.AsyncClusterClient(concurrency=args.concurrency) as cluster:
+            start = time.perf_counter()
+            await fan_out(cluster, cids)
+            return time.perf_counter() - start
+
+    async_elapsed = asyncio.run(run())
+
+    start = time.perf_counter()
+    for cid in cids:
+        ipfs_cluster.get_file_status(cid)
+    serial_elapsed = time.perf_counter() - start
+
+    print(f"status x{args.cids} serial              {serial_elapsed:8.3f}s")
+    print(f"status x{args.cids} async (limit {args.concurrency:>3})  {async_elapsed:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Load-test the upload, listing and delete flows of client.py on a single box.
+KV calls go to the in-process memory or SQLite backend with injected latency,
+and the IPFS cluster calls are replaced by in-process fakes.
+
+Run from the repository root:
+    python3 benchmarks/client_flows_bench.py --backend memory --latency-ms 20 --jitter-ms 5 \
+        --peers 5 --files-per-peer 2000
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+import kv_service as kv
+import ipfs_cluster
+
+PEERS = []
+_cid_counter = itertools.count()
+
+# The cluster is not part of this benchmark, only the KV traffic of the flows
+ipfs_cluster.get_my_peer_id = lambda: PEERS[0]
+ipfs_cluster.add_file_to_cluster = lambda file_path, *args, **kwargs: f"QmBench{next(_cid_counter):040d}"
+ipfs_cluster.remove_file_from_cluster = lambda cid, *args, **kwargs: True
+ipfs_cluster.list_all_peers = lambda: {'cluster_peers': list(PEERS)}
+ipfs_cluster.get_peer_name = lambda peer_id: f"name-{peer_id}"
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f}s total  {elapsed / max(count, 1) * 1000:8.2f} ms/op")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--sqlite-path", default=os.path.join(tempfile.gettempdir(), "resshare_bench.sqlite3"))
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--peers", type=int, default=5)
+    parser.add_argument("--files-per-peer", type=int, default=1000)
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--deletes", type=int, default=20)
+    args = parser.parse_args()
+
+    PEERS.extend(f"bench-peer-{i}" for i in range(args.peers))
+    options = {'latency': args.latency_ms / 1000, 'jitter': args.jitter_ms / 1000}
+    if args.backend == "sqlite":
+        if os.path.exists(args.sqlite_path):
+            os.remove(args.sqlite_path)
+        options['path'] = args.sqlite_path
+    seed_backend = kv.create_backend(args.backend, **dict(options, latency=0, jitter=0))
+    kv.use_backend(seed_backend)
+
+    import client
+    # The fake CIDs never match the content, see dedup_upload_bench.py for the skip path
+    client.skip_pinned_uploads = False
+
+    # Seed every peer without latency so only the measured flows pay for it
+    for peer in PEERS:
+        for _ in range(args.files_per_peer):
+            cid = ipfs_cluster.add_file_to_cluster(None)
+            client._add_to_file_index(peer, cid, {'file_name': f"{cid}.jpg", 'file_size': 1024, 'timestamp': '2024-11-08'})
+            kv.set_kv(cid, kv.encode_value(kv.DELETION_RECORD, {cid: {peer: False}}))
+    if args.backend == "sqlite":
+        seed_backend = kv.create_backend("sqlite", **options)
+    else:
+        seed_backend.latency, seed_backend.jitter = options['latency'], options['jitter']
+    kv.use_backend(seed_backend)
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as upload:
+        upload.write(b"x" * 1024)
+        upload.flush()
+        timed(f"upload x{args.uploads}", args.uploads, lambda: [client.upload_file(upload.name) for _ in range(args.uploads)])
+
+    listing = []
+    timed("get_all_file (cold cache)", 1, lambda: listing.append(client.get_all_file()))
+    timed("get_all_file (warm cache)", 1, client.get_all_file)
+    timed("fetch_dashboard_data", 1, client.fetch_dashboard_data)
+
+    mine = [entry['CID'] for entry in listing[0] if entry['peerID'] == PEERS[0]][:args.deletes]
+    timed(f"delete_file x{len(mine)}", len(mine), lambda: [client.delete_file(cid) for cid in mine])
+    print(f"files listed: {len(listing[0])}, cache: {kv.cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare upload time with and without the local CID check on a duplicate-heavy workload.
+A local HTTP server stands in for the cluster: /add receives the file at a throttled rate,
+computes its CID and pins it, /pins/<cid> reports what is pinned. KV calls go to the memory backend.
+
+Run from the repository root:
+    python3 benchmarks/dedup_upload_bench.py --files 200 --unique 20 --size-mb 8 --mbps 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath("."))
+import kv_service as kv
+import blob_cache
+import ipfs_cluster
+import unixfs
+
+ipfs_cluster.get_my_peer_id = lambda: "bench-peer"
+# Only the cluster transfer is measured
+blob_cache.max_bytes = 0
+
+
+class FakeClusterHandler(BaseHTTPRequestHandler):
+    pinned = set()
+    bytes_per_second = 0
+    received = 0
+
+    def do_POST(self):
+        boundary = self.headers['Content-Type'].split('boundary=')[1].encode()
+        with tempfile.NamedTemporaryFile() as body:
+            # The streaming upload is chunked, read it at the configured link speed
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body.write(self.rfile.read(size))
+                self.rfile.readline()
+                if self.bytes_per_second:
+                    time.sleep(size / self.bytes_per_second)
+            FakeClusterHandler.received += body.tell()
+            body.seek(0)
+            data = body.read()
+        start = data.index(b'\r\n\r\n') + 4
+        end = data.rindex(b'\r\n--' + boundary)
+        with tempfile.NamedTemporaryFile() as content:
+            content.write(data[start:end])
+            content.flush()
+            cid = unixfs.compute_cid(content.name)
+        self.pinned.add(cid)
+        self._reply(200, {'name': 'bench', 'cid': {'/': cid}})
+
+    def do_GET(self):
+        cid = self.path.split('?')[0].rsplit('/', 1)[-1]
+        if cid in self.pinned:
+            self._reply(200, {'cid': {'/': cid}, 'peer_map': {'bench-peer': {'status': 'pinned'}}})
+        else:
+            self._reply(200, {'cid': {'/': cid}, 'peer_map': {'bench-peer': {'status': 'unpinned'}}})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(client, paths, skip_pinned):
+    FakeClusterHandler.pinned = set()
+    FakeClusterHandler.received = 0
+    kv.use_backend(kv.create_backend("memory"))
+    client.skip_pinned_uploads = skip_pinned
+    start = time.perf_counter()
+    for path in paths:
+        client.upload_file(path)
+    return time.perf_counter() - start, FakeClusterHandler.received
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200, help="Uploads in the workload")
+    parser.add_argument("--unique", type=int, default=20, help="Distinct contents among the uploads")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--mbps", type=float, default=200, help="Simulated uplink to the cluster, 0 for unlimited")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeClusterHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ipfs_cluster.ipfs_cluster_api_url = ipfs_cluster.ipfs_gateway_url = f"http://127.0.0.1:{server.server_port}/"
+    FakeClusterHandler.bytes_per_second = args.mbps * 125000
+
+    import client
+
+    with tempfile.TemporaryDirectory() as directory:
+        contents = []
+        for i in range(args.unique):
+            path = os.path.join(directory, f"content-{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+            contents.append(path)
+        rng = random.Random(1)
+        paths = contents + [rng.choice(contents) for _ in range(args.files - args.unique)]
+        rng.shuffle(paths)
+
+        print(f"{args.files} uploads of {args.unique} distinct {args.size_mb} MB files at {args.mbps} Mbit/s")
+        for label, skip_pinned in (("always upload", False), ("skip pinned CIDs", True)):
+            elapsed, received = run(client, paths, skip_pinned)
+            print(f"{label:<18} {elapsed:8.2f}s  {received / 1024 / 1024:10.1f} MB sent  "
+                  f"{elapsed / args.files * 1000:8.1f} ms/upload")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare the per-call cost of the old one-shot pybind_kv.get/set functions
+(parse config + build a KVClient every call) against a shared KVSession.
+
+Run from the repository root after building the bazel targets:
+    python3 benchmarks/kv_session_bench.py --calls 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+import kv_service as kv
+
+
+def timed(label, calls, fn):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {calls} calls  {elapsed:8.3f}s  {elapsed / calls * 1000:8.3f} ms/call")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--key", default="bench kv_session")
+    args = parser.parse_args()
+
+    session = kv.KVSession()
+    session.set(args.key, "value")
+
+    per_call_get = timed("per-call get", args.calls, lambda i: kv.pybind_kv.get(args.key, kv.config_path))
+    session_get = timed("session get", args.calls, lambda i: session.get(args.key))
+    per_call_set = timed("per-call set", args.calls, lambda i: kv.pybind_kv.set(args.key, str(i), kv.config_path))
+    session_set = timed("session set", args.calls, lambda i: session.set(args.key, str(i)))
+
+    print(f"get speedup: {per_call_get / session_get:.2f}x")
+    print(f"set speedup: {per_call_set / session_set:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Stress parallel uploads from one node and check that no CID is lost from the
+peer's file index, the deletion records or the favorites list.
+KV calls go to the in-process memory backend with injected latency and the
+cluster add is replaced by a fake, so this runs on a single box.
+
+Three scenarios run on fresh backends:
+    many uploads      --uploads uploads and --favorites favorites, spread over many segments
+    fresh index       fewer uploads than one segment holds, so only the first segment is used
+    failing backend   reads fail with probability --failure-rate; every upload must return or
+                      raise within --timeout seconds, and every CID it returned must be indexed
+
+Run from the repository root:
+    python3 benchmarks/parallel_upload_stress.py --threads 64 --uploads 2000
+Exits with status 1 if any update was lost or an upload hung.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+sys.path.insert(0, os.path.abspath("."))
+import kv_service as kv
+import ipfs_cluster
+
+_cid_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+
+def fake_add(file_path, *args, **kwargs):
+    with _counter_lock:
+        return f"QmStress{next(_cid_counter):040d}"
+
+
+ipfs_cluster.get_my_peer_id = lambda: "stress-peer"
+ipfs_cluster.add_file_to_cluster = fake_add
+ipfs_cluster.get_peer_name = lambda peer_id: f"name-{peer_id}"
+
+
+class FlakyBackend(kv.MemoryBackend):
+    """
+    A memory backend whose reads raise ConnectionError with probability failure_rate
+    """
+
+    def __init__(self, failure_rate, **kwargs):
+        super().__init__(**kwargs)
+        self.failure_rate = failure_rate
+        self._random = random.Random(1)
+
+    def _maybe_fail(self):
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError("injected KV read failure")
+
+    def get(self, key):
+        self._maybe_fail()
+        return super().get(key)
+
+    def get_many(self, keys):
+        self._maybe_fail()
+        return super().get_many(keys)
+
+
+def run(client, backend, threads, uploads, favorites, timeout):
+    """
+    :return: (seconds, {check: (found, expected)}). Exits with status 1 if a call hung.
+    """
+    kv.use_backend(backend)
+    first = next(_cid_counter)
+
+    def upload(_):
+        try:
+            return client.upload_file(upload_file.name)
+        except Exception:
+            return None
+
+    def add_favorite(i):
+        try:
+            return client.add_favorite_peer(f"peer-{i}", f"nick-{i}")
+        except Exception:
+            return None
+
+    with tempfile.NamedTemporaryFile() as upload_file, ThreadPoolExecutor(threads) as pool:
+        upload_file.write(b"stress")
+        upload_file.flush()
+        start = time.perf_counter()
+        futures = [pool.submit(upload, i) for i in range(uploads)]
+        futures += [pool.submit(add_favorite, i) for i in range(favorites)]
+        try:
+            cids = {future.result(timeout=timeout) for future in futures[:uploads]} - {None}
+            for future in futures[uploads:]:
+                future.result(timeout=timeout)
+        except TimeoutError:
+            print(f"HUNG: a call did not finish within {timeout}s, pending mutations: {list(kv._key_mutations)}",
+                  flush=True)
+            # The hung threads can never be joined
+            os._exit(1)
+        elapsed = time.perf_counter() - start
+
+    if isinstance(backend, FlakyBackend):
+        # Verify against a healthy backend, only what the calls reported as done must be there
+        backend.failure_rate = 0
+    else:
+        cids = {f"QmStress{i:040d}" for i in range(first + 1, first + 1 + uploads)}
+    indexed = set(client.get_other_peer_file_structure("stress-peer"))
+    with_record = {cid for cid in cids if kv.decode_value(kv.DELETION_RECORD, kv.get_kv(cid, fresh=True))}
+    checks = {'indexed': (len(indexed & cids), len(cids)), 'deletion records': (len(with_record), len(cids))}
+    if favorites and not isinstance(backend, FlakyBackend):
+        checks['favorites'] = (len(client.get_my_favorite_peer()), favorites)
+    if kv._key_mutations:
+        checks['idle mutation queues'] = (0, len(kv._key_mutations))
+    return elapsed, checks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--uploads", type=int, default=2000)
+    parser.add_argument("--favorites", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=10)
+    parser.add_argument("--segment-size", type=int, default=64)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a call counts as hung")
+    args = parser.parse_args()
+
+    latency = {'latency': args.latency_ms / 1000, 'jitter': args.latency_ms / 4000}
+
+    import client
+    # The fake CIDs never match the content, see dedup_upload_bench.py for the skip path
+    client.skip_pinned_uploads = False
+    client.INDEX_SEGMENT_SIZE = args.segment_size
+
+    scenarios = [
+        ("many uploads", kv.MemoryBackend(**latency), args.uploads, args.favorites),
+        ("fresh index", kv.MemoryBackend(**latency), max(1, args.segment_size // 2), 0),
+        ("failing backend", FlakyBackend(args.failure_rate, **latency), args.uploads // 4, args.favorites // 4),
+    ]
+    failed = False
+    for name, backend, uploads, favorites in scenarios:
+        elapsed, checks = run(client, backend, args.threads, uploads, favorites, args.timeout)
+        summary = ", ".join(f"{check} {found}/{expected}" for check, (found, expected) in checks.items())
+        print(f"{name}: {uploads} uploads + {favorites} favorites on {args.threads} threads in {elapsed:.2f}s, {summary}")
+        lost = sum(expected - found for found, expected in checks.values())
+        if lost:
+            print(f"{name}: LOST {lost} updates")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Show that add_file_to_cluster keeps peak RSS flat while uploading multi-GB files.
+A local HTTP server stands in for the cluster /add endpoint and discards the body.
+Each upload runs in a fresh subprocess so its peak RSS is measured alone.
+
+Run from the repository root:
+    python3 benchmarks/stream_upload_rss_bench.py --sizes-gb 1 2 4
+Pass --buffered to also measure the previous requests `files=` upload for comparison.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath("."))
+
+
+class DiscardingAddHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        received = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                while size:
+                    chunk = self.rfile.read(min(size, 1 << 20))
+                    received += len(chunk)
+                    size -= len(chunk)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 1 << 20))
+                received += len(chunk)
+                remaining -= len(chunk)
+        body = json.dumps({'name': 'bench', 'cid': {'/': 'QmBench'}, 'size': received}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def upload_once(url, path, buffered):
+    import ipfs_cluster
+    ipfs_cluster.ipfs_cluster_api_url = url
+    ipfs_cluster.ipfs_gateway_url = url
+    if buffered:
+        with open(path, 'rb') as f:
+            ipfs_cluster._request("POST", 'add', url + "add", files={'file': f})
+    else:
+        ipfs_cluster.add_file_to_cluster(path)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-gb", type=float, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--buffered", action="store_true")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        url, path, mode = args.child
+        upload_once(url, path, mode == "buffered")
+        return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DiscardingAddHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    modes = ["streaming"] + (["buffered"] if args.buffered else [])
+    print(f"{'size GB':>8} " + " ".join(f"{mode + ' peak RSS MB':>24}" for mode in modes))
+    for size_gb in args.sizes_gb:
+        with tempfile.NamedTemporaryFile() as f:
+            # Sparse file, so the benchmark does not need the disk space
+            f.truncate(int(size_gb * 1024 ** 3))
+            row = []
+            for mode in modes:
+                out = subprocess.run([sys.executable, __file__, "--child", url, f.name, mode],
+                                     capture_output=True, text=True, check=True).stdout
+                row.append(int(out.strip().splitlines()[-1]) / 1024)
+            print(f"{size_gb:>8} " + " ".join(f"{rss:>24.1f}" for rss in row))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure the KV cost of recording one upload as a peer's file count grows,
+for the per-file index layout and for the legacy whole-peer JSON blob.
+
+The IPFS add is not included, only the metadata update that scales with the
+number of files. Run from the repository root:
+    python3 benchmarks/upload_index_bench.py --sizes 0 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+import kv_service as kv
+import client
+
+FILE_INFO = {'file_name': 'photo.jpg', 'file_size': 123456, 'timestamp': '2024-11-08'}
+
+
+def seed_index(peer_id, count):
+    """
+    Write count file records straight into the per-file layout
+    """
+    writes = {}
+    segments = (count + client.INDEX_SEGMENT_SIZE - 1) // client.INDEX_SEGMENT_SIZE
+    for segment in range(segments):
+        cids = [f"seed-{segment}-{i}" for i in range(min(client.INDEX_SEGMENT_SIZE, count - segment * client.INDEX_SEGMENT_SIZE))]
+        writes[client._segment_key(peer_id, segment)] = json.dumps(cids)
+        for cid in cids:
+            writes[client._file_key(peer_id, cid)] = json.dumps(dict(FILE_INFO, segment=segment))
+        if len(writes) > 10000:
+            kv.set_many(writes)
+            writes = {}
+    kv.set_many(writes)
+    kv.set_kv(client._index_key(peer_id), json.dumps({'version': 1, 'segments': segments}))
+
+
+def legacy_upload(peer_id, cid):
+    structure = json.loads(kv.get_kv(peer_id, fresh=True) or "{}")
+    structure[cid] = FILE_INFO
+    payload = json.dumps(structure)
+    kv.set_kv(peer_id, payload)
+    return len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 1000, 10000, 100000])
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    run = str(int(time.time()))
+    print(f"{'files':>8} {'index ms/upload':>16} {'legacy ms/upload':>17} {'legacy payload':>15}")
+    for size in args.sizes:
+        peer_id = f"bench-{run}-{size}"
+        seed_index(peer_id, size)
+        start = time.perf_counter()
+        for i in range(args.uploads):
+            client._add_to_file_index(peer_id, f"new-{i}", FILE_INFO)
+        index_ms = (time.perf_counter() - start) / args.uploads * 1000
+
+        legacy_ms, payload = float("nan"), 0
+        if not args.skip_legacy:
+            kv.set_kv(peer_id, json.dumps({f"seed-{i}": FILE_INFO for i in range(size)}))
+            start = time.perf_counter()
+            for i in range(args.uploads):
+                payload = legacy_upload(peer_id, f"new-{i}")
+            legacy_ms = (time.perf_counter() - start) / args.uploads * 1000
+        print(f"{size:>8} {index_ms:>16.2f} {legacy_ms:>17.2f} {payload:>15}")
+
+
+if __name__ == "__main__":
+    main()
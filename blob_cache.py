@@ -0,0 +1,247 @@
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, reflinks are skipped there
+    fcntl = None
+
+# Where cached blobs are stored, one file per CID
+cache_dir = os.environ.get("RESSHARE_BLOB_CACHE_DIR", os.path.expanduser("~/.resshare/blobs"))
+
+# Total size of the cached blobs, 0 disables the cache
+max_bytes = int(os.environ.get("RESSHARE_BLOB_CACHE_MB", "1024")) * 1024 * 1024
+
+# Serve hits as hardlinks to the cached blob. Faster than a copy on filesystems without reflinks,
+# but editing the downloaded file in place would also change the cached blob, so it is opt-in.
+use_hardlinks = os.environ.get("RESSHARE_BLOB_CACHE_HARDLINKS") == "1"
+
+# ioctl number of FICLONE on Linux, clones a file by sharing its extents (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _reflink(src_file, dst_path) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(dst_path, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _clone(src_file, dst_path):
+    """
+    Writes the content of the open file src_file to dst_path, as a reflink where the filesystem
+    supports it and as a plain copy otherwise.
+    """
+    if not _reflink(src_file, dst_path):
+        src_file.seek(0)
+        with open(dst_path, "wb") as dst_file:
+            shutil.copyfileobj(src_file, dst_file, 1024 * 1024)
+
+
+class BlobCache:
+    """
+    Files keyed by CID on local disk. CIDs are immutable, so a cached blob never goes stale.
+    When the cache grows past max_bytes, the least recently used blobs are removed.
+    Safe to share between threads.
+
+    :param directory: Where blobs are stored, existing blobs are picked up again
+    :param max_bytes: Size limit of all blobs together
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, cid: str) -> str:
+        return os.path.join(self.directory, cid)
+
+    def _load(self):
+        blobs = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                # Leftover of an interrupted put()
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, cid, size in sorted(blobs):
+            self._entries[cid] = size
+            self._size += size
+        with self._lock:
+            self._evict(0)
+
+    def _evict(self, incoming: int):
+        while self._entries and self._size + incoming > self.max_bytes:
+            cid, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(cid))
+            except FileNotFoundError:
+                pass
+
+    def put(self, cid: str, file_path: str) -> bool:
+        """
+        Copies file_path into the cache under cid. The file is cloned, not linked,
+        so later changes to file_path do not reach the cache.
+
+        :return: Whether the blob is cached
+        """
+        with self._lock:
+            if cid in self._entries:
+                self._entries.move_to_end(cid)
+                return True
+        try:
+            size = os.path.getsize(file_path)
+            if size > self.max_bytes:
+                return False
+            temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}")
+            with open(file_path, "rb") as src_file:
+                _clone(src_file, temp_path)
+        except OSError as e:
+            print(f"Could not cache {cid}: {e}")
+            return False
+
+        with self._lock:
+            if cid in self._entries:
+                os.remove(temp_path)
+                return True
+            self._evict(size)
+            os.replace(temp_path, self._path(cid))
+            self._entries[cid] = size
+            self._size += size
+        return True
+
+    def get(self, cid: str, dest_path: str) -> bool:
+        """
+        Writes the cached blob of cid to dest_path.
+
+        :return: False on a miss, dest_path is not touched then
+        """
+        with self._lock:
+            size = self._entries.get(cid)
+            src_file = None
+            if size is not None:
+                try:
+                    # Once open, the blob stays readable even if it is evicted meanwhile
+                    src_file = open(self._path(cid), "rb")
+                    self._entries.move_to_end(cid)
+                    # The mtime keeps the LRU order across restarts, see _load()
+                    os.utime(src_file.fileno())
+                except FileNotFoundError:
+                    del self._entries[cid]
+                    self._size -= size
+            if src_file is None:
+                self.misses += 1
+                return False
+
+        with src_file:
+            try:
+                if not (use_hardlinks and self._hardlink(cid, dest_path)):
+                    _clone(src_file, dest_path)
+            except OSError as e:
+                print(f"Could not serve {cid} from the cache: {e}")
+                with self._lock:
+                    self.misses += 1
+                return False
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        return True
+
+    def open(self, cid: str, length: int = None):
+        """
+        Opens the cached blob of cid for reading, for serving it without a copy.
+
+        :param length: Bytes that will be read, counted as saved. Defaults to the whole blob.
+        :return: A binary file object the caller closes, or None on a miss
+        """
+        with self._lock:
+            size = self._entries.get(cid)
+            if size is not None:
+                try:
+                    blob = open(self._path(cid), "rb")
+                    self._entries.move_to_end(cid)
+                    os.utime(blob.fileno())
+                    self.hits += 1
+                    self.bytes_saved += size if length is None else min(length, size)
+                    return blob
+                except FileNotFoundError:
+                    del self._entries[cid]
+                    self._size -= size
+            self.misses += 1
+            return None
+
+    def _hardlink(self, cid: str, dest_path: str) -> bool:
+        try:
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            os.link(self._path(cid), dest_path)
+            return True
+        except OSError:
+            return False
+
+    def __contains__(self, cid: str) -> bool:
+        with self._lock:
+            return cid in self._entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+            }
+
+
+def get_cache():
+    """
+    The shared BlobCache, created on first use from cache_dir and max_bytes.
+
+    :return: None when the cache is disabled or its directory is not usable
+    """
+    global _cache
+    if max_bytes <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = BlobCache(cache_dir, max_bytes)
+            except OSError as e:
+                print(f"Blob cache disabled, {cache_dir} is not usable: {e}")
+                return None
+        return _cache
+
+
+def cache_stats() -> dict:
+    """
+    Hit ratio and bytes saved of the shared cache, see BlobCache.stats()
+    """
+    cache = get_cache()
+    return cache.stats() if cache else {'enabled': False}
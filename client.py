@@ -1,13 +1,247 @@
 import kv_service as kv
 import ipfs_cluster as ipfs
+import blob_cache
+import unixfs
 import json
 import os
 import mimetypes
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 # Global variable
 my_ipfs_cluster_id = ipfs.get_my_peer_id()
 
-def upload_file(file_path: str):
+# Number of CIDs stored in one segment of a peer's file index
+INDEX_SEGMENT_SIZE = 256
+
+# Compute the CID locally before uploading and skip the transfer when the cluster already pins it
+skip_pinned_uploads = True
+
+# Cluster adds running at once for one upload_files() batch
+batch_upload_workers = 4
+
+# Serializes migrate_legacy_file_structure() within this process, like kv.update()
+_migration_lock = threading.Lock()
+
+# Per-peer file index layout in ResilientDB:
+#     "<PEER_ID> INDEX":          manifest {"version": 1, "segments": N}
+#     "<PEER_ID> INDEX <i>":      segment i, a list of at most INDEX_SEGMENT_SIZE CIDs
+#     "<PEER_ID> FILE <CID>":     file record {"file_name", "file_size", "timestamp", "segment"}
+# Segments and file records are written with kv.encode_value(), the manifest stays JSON.
+#
+# Adding or removing a file rewrites one segment and one file record, so the payload does not grow
+# with the number of files a peer owns. Peers without a manifest still use the legacy layout, where
+# the whole my_file_structure dict is stored under "<PEER_ID>"; see migrate_legacy_file_structure().
+#
+# An uploaded directory is indexed like a file under its root CID, with a file_name ending in "/".
+# Its files are listed under "<ROOT_CID> DIR", see upload_directory().
+
+
+def _index_key(peer_id: str) -> str:
+    return f"{peer_id} INDEX"
+
+
+def _segment_key(peer_id: str, segment: int) -> str:
+    return f"{peer_id} INDEX {segment}"
+
+
+def _file_key(peer_id: str, cid: str) -> str:
+    return f"{peer_id} FILE {cid}"
+
+
+def _directory_key(cid: str) -> str:
+    return f"{cid} DIR"
+
+
+def _parse_json(raw: str, default):
+    try:
+        return json.loads(raw) if raw else default
+    except json.JSONDecodeError:
+        return default
+
+
+def _load_manifest(peer_id: str, fresh: bool = False):
+    """
+    :return: The manifest dict, or None if the peer has not been migrated to the per-file layout
+    """
+    return _parse_json(kv.get_kv(_index_key(peer_id), fresh=fresh), None)
+
+
+def migrate_legacy_file_structure(peer_id: str) -> dict:
+    """
+    Copy a legacy whole-peer JSON blob into the per-file layout.
+    The file records are written first and the manifest last, so an interrupted migration is simply
+    redone on the next call. The legacy blob is left untouched but is no longer read once the manifest exists.
+    Migrations run one at a time, so a late one cannot overwrite segments that uploads already
+    appended to after an earlier one finished.
+
+    :param peer_id: The peer whose files should be migrated, normally my_ipfs_cluster_id
+    :return: The manifest of the peer
+    """
+    # A manifest never goes away, so a cached one is good enough here
+    manifest = _load_manifest(peer_id) or _load_manifest(peer_id, fresh=True)
+    if manifest is not None:
+        return manifest
+
+    with _migration_lock:
+        return _migrate(peer_id)
+
+
+def _migrate(peer_id: str) -> dict:
+    # Called with _migration_lock held, a migration that finished while this call waited is not redone
+    manifest = _load_manifest(peer_id, fresh=True)
+    if manifest is not None:
+        return manifest
+
+    legacy_structure = _parse_file_structure(kv.get_kv(peer_id, fresh=True))
+    cids = list(legacy_structure)
+    records = {}
+    segment_writes = {}
+    segments = 0
+    for start in range(0, len(cids), INDEX_SEGMENT_SIZE):
+        segment_cids = cids[start:start + INDEX_SEGMENT_SIZE]
+        segment_writes[_segment_key(peer_id, segments)] = kv.encode_value(kv.CID_LIST, segment_cids)
+        for cid in segment_cids:
+            records[_file_key(peer_id, cid)] = kv.encode_value(kv.FILE_RECORD, dict(legacy_structure[cid], segment=segments))
+        segments += 1
+
+    # File records, then segments, then the manifest. Until the manifest exists every reader still uses
+    # the legacy blob, which is never modified, so a crash at any point leaves each CID readable and
+    # the next call redoes the migration from the blob.
+    if not kv.set_many(records) or not kv.set_many(segment_writes):
+        raise RuntimeError(f"Failed to migrate file structure of peer {peer_id}")
+    # Only create the manifest if a parallel upload did not migrate and grow the index meanwhile
+    manifest = json.dumps({'version': 1, 'segments': segments})
+    manifest = kv.update(_index_key(peer_id), lambda raw: kv.UNCHANGED if raw else manifest)
+    if cids:
+        print(f"Migrated {len(cids)} files of peer {peer_id} to the per-file layout")
+    return json.loads(manifest)
+
+
+def _append_cids(cids: list, placed: list, segment_cids: list):
+    """
+    Appends as many of cids as fit into a segment, the CIDs now in the segment are collected in placed
+    """
+    placed.clear()
+    changed = False
+    for cid in cids:
+        if cid in segment_cids:
+            placed.append(cid)
+        elif len(segment_cids) < INDEX_SEGMENT_SIZE:
+            segment_cids.append(cid)
+            placed.append(cid)
+            changed = True
+    return segment_cids if changed else kv.UNCHANGED
+
+
+def _grow_manifest(segments: int, raw: str):
+    manifest = _parse_json(raw, None) or {'version': 1, 'segments': 0}
+    if manifest['segments'] >= segments:
+        return kv.UNCHANGED
+    manifest['segments'] = segments
+    return json.dumps(manifest)
+
+
+def _add_to_file_index(peer_id: str, cid: str, file_info: dict):
+    """
+    Record one file in the peer's index. Only the file record and one segment are written.
+    """
+    _add_many_to_file_index(peer_id, {cid: file_info})
+
+
+def _add_many_to_file_index(peer_id: str, files: dict):
+    """
+    Record several files in the peer's index. New CIDs are appended to the last segment in one update,
+    spilling into the next segment only when it is full, and all file records go out in one batched write.
+    Segment and manifest changes go through kv.update(), so parallel uploads never drop each other's CIDs.
+
+    :param files: {CID: file info}, see upload_file()
+    """
+    records = kv.get_many([_file_key(peer_id, cid) for cid in files], fresh=True)
+    segment_of = {}
+    for cid in files:
+        existing_record = kv.decode_value(kv.FILE_RECORD, records[_file_key(peer_id, cid)])
+        if existing_record is not None:
+            segment_of[cid] = existing_record['segment']
+
+    pending = [cid for cid in files if cid not in segment_of]
+    if pending:
+        segments = migrate_legacy_file_structure(peer_id)['segments']
+        segment = max(segments - 1, 0)
+        placed = []
+        while True:
+            kv.update(_segment_key(peer_id, segment), lambda cids: _append_cids(pending, placed, cids), kind=kv.CID_LIST, default=[])
+            segment_of.update(dict.fromkeys(placed, segment))
+            pending = [cid for cid in pending if cid not in segment_of]
+            if not pending:
+                break
+            segment += 1
+        # A new index has no segments yet, and a full one just rolled over to the next
+        if segment >= segments:
+            kv.update(_index_key(peer_id), lambda raw: _grow_manifest(segment + 1, raw))
+
+    if not kv.set_many({_file_key(peer_id, cid): kv.encode_value(kv.FILE_RECORD, dict(info, segment=segment_of[cid]))
+                        for cid, info in files.items()}):
+        raise RuntimeError(f"Failed to write file records of peer {peer_id}")
+
+
+def _remove_cid(cid: str, segment_cids: list):
+    if cid not in segment_cids:
+        return kv.UNCHANGED
+    segment_cids.remove(cid)
+    return segment_cids
+
+
+def _remove_from_file_index(peer_id: str, cid: str) -> bool:
+    """
+    Remove one file from the peer's index. Only its segment and file record are written.
+
+    :return: True if the file was in the index
+    """
+    migrate_legacy_file_structure(peer_id)
+    record = kv.decode_value(kv.FILE_RECORD, kv.get_kv(_file_key(peer_id, cid), fresh=True))
+    if record is None:
+        return False
+
+    kv.update(_segment_key(peer_id, record['segment']), lambda cids: _remove_cid(cid, cids), kind=kv.CID_LIST, default=[])
+    kv.set_kv(_file_key(peer_id, cid), "")
+    return True
+
+
+def _load_file_structures(peers: list) -> dict:
+    """
+    Load the file structure of several peers with a fixed number of batched KV reads,
+    whatever the number of peers and files
+
+    :param peers: A list of peer IDs
+    :return: A python dict {PEER_ID: my_file_structure}
+    """
+    manifests = kv.get_many(_index_key(peer) for peer in peers)
+    manifests = {peer: _parse_json(manifests[_index_key(peer)], None) for peer in peers}
+    legacy_peers = [peer for peer in peers if manifests[peer] is None]
+
+    segment_keys = [_segment_key(peer, i) for peer in peers if manifests[peer] for i in range(manifests[peer]['segments'])]
+    raw_values = kv.get_many(legacy_peers + segment_keys)
+
+    structures = {peer: _parse_file_structure(raw_values[peer]) for peer in legacy_peers}
+    peer_cids = []
+    for peer in peers:
+        if manifests[peer] is not None:
+            structures[peer] = {}
+            for i in range(manifests[peer]['segments']):
+                peer_cids.extend((peer, cid) for cid in kv.decode_value(kv.CID_LIST, raw_values[_segment_key(peer, i)], []))
+
+    records = kv.get_many(_file_key(peer, cid) for peer, cid in peer_cids)
+    for peer, cid in peer_cids:
+        record = kv.decode_value(kv.FILE_RECORD, records[_file_key(peer, cid)])
+        if record is not None:
+            record.pop('segment', None)
+            structures[peer][cid] = record
+    return structures
+
+
+def upload_file(file_path: str, replication_min: int = None, replication_max: int = None, on_stage=None):
     """
     The whole process of uploading a file
     This function should be called when user want to upload a file
@@ -21,68 +255,330 @@ def upload_file(file_path: str):
                                             "file_size": FILE_SIZE_2(int)(bytes),
                                         },
                         }
+    Each entry is stored as its own KV record, see the index layout at the top of this file.
 
 
     :param file_path: THe file path on user's local machine
-    :return None
+    :param replication_min: Minimum number of peers pinning the file, the cluster default if None
+    :param replication_max: Maximum number of peers pinning the file, the cluster default if None.
+                            More replicas spread the gateway reads of popular files over more peers.
+    :param on_stage: Optional callback on_stage(stage, cid=CID), called with 'added' once the cluster has the file
+                     and with 'indexed' once its KV records are written, see upload_jobs.py
+    :return The CID of the file, or None if the cluster add failed
     """
     global my_ipfs_cluster_id
 
-    # Get my current files under my IPFS cluster peer ID
-    my_file_structure = kv.get_kv(my_ipfs_cluster_id)
-    try:
-        my_file_structure = json.loads(my_file_structure)
-    except:
-        print("File structure broken or empty")
-        my_file_structure = {}
-
     # Generate metadata of this file
-    new_file_info = {'file_name': os.path.basename(file_path), 'file_size': os.path.getsize(file_path), 'timestamp': datetime.now().strftime("%Y-%m-%d")}
+    new_file_info = _file_info(file_path)
 
-    # Send to IPFS cluster and get CID
-    cid = ipfs.add_file_to_cluster(file_path)
+    cid = _add_to_cluster(file_path, replication_min, replication_max)
+    if not cid:
+        return None
+    if on_stage is not None:
+        on_stage('added', cid=cid)
 
-    # Update ResilientDB
-    my_file_structure[cid] = new_file_info
-    kv.set_kv(my_ipfs_cluster_id, json.dumps(my_file_structure))
+    _record_upload(cid, new_file_info)
+    if on_stage is not None:
+        on_stage('indexed', cid=cid)
+    return cid
 
-    #Seperate KV pair for Delete File
-    
-    delete_file_structure = kv.get_kv(cid)
-    try:
-        parsed = json.loads(delete_file_structure)
-        
-        result = {}
-        for outer_key, inner_dict in parsed.items():
-            result[outer_key] = {}
-            for inner_key, value in inner_dict.items():
-                result[outer_key][inner_key] = value
-        
-        delete_file_structure = result
-    except json.JSONDecodeError:
-        print("Delete File structure is not valid JSON")
-        delete_file_structure = {}
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        delete_file_structure = {}
 
-    # Now delete_file_structure has the desired format
-    print(delete_file_structure)
+def _file_info(file_path: str) -> dict:
+    return {'file_name': os.path.basename(file_path), 'file_size': os.path.getsize(file_path), 'timestamp': datetime.now().strftime("%Y-%m-%d")}
 
-    if cid not in delete_file_structure:
-        delete_file_structure[cid] = {my_ipfs_cluster_id: False}
+
+def _add_to_cluster(file_path: str, replication_min: int = None, replication_max: int = None):
+    """
+    Sends a file to the cluster unless it is already pinned, and keeps a copy in the blob cache
+
+    :return: The CID, or None if the cluster add failed
+    """
+    # Content that is already pinned only needs its metadata, see unixfs.compute_cid()
+    local_cid = unixfs.compute_cid(file_path) if skip_pinned_uploads else None
+    if local_cid and ipfs.is_pinned(local_cid):
+        print(f"CID {local_cid} is already pinned, skipping the upload")
+        cid = local_cid
+        if replication_min is not None or replication_max is not None:
+            ipfs.pin_file(cid, replication_min, replication_max)
     else:
-        delete_file_structure[cid][my_ipfs_cluster_id] = False
+        # Send to IPFS cluster and get CID
+        cid = ipfs.add_file_to_cluster(file_path, replication_min=replication_min, replication_max=replication_max)
+        if local_cid and cid and cid != local_cid:
+            print(f"Cluster assigned {cid}, expected {local_cid}. Check ipfs_cluster.add_params.")
+    if not cid:
+        return None
+
+    # Keep a local copy, a later download of this CID is then served from disk
+    cache = blob_cache.get_cache()
+    if cache:
+        cache.put(cid, file_path)
+    return cid
+
+
+def _mark_uploaded(cid: str):
+    #Seperate KV pair for Delete File
     
-    kv.set_kv(cid, json.dumps(delete_file_structure))
+    def mark_uploaded(delete_file_structure):
+        delete_file_structure.setdefault(cid, {})[my_ipfs_cluster_id] = False
+        return delete_file_structure
+
+    print(kv.update(cid, mark_uploaded, kind=kv.DELETION_RECORD, default={}))
+
+
+def _record_upload(cid: str, new_file_info: dict):
+    """
+    Adds an uploaded CID to this peer's file index and its deletion record
+    """
+    # Update ResilientDB
+    _add_to_file_index(my_ipfs_cluster_id, cid, new_file_info)
+    _mark_uploaded(cid)
+
+
+def upload_files(file_paths: list, replication_min: int = None, replication_max: int = None, on_stage=None) -> list:
+    """
+    Uploads a batch of files. Up to batch_upload_workers cluster adds run at once, each file's deletion record
+    is written as soon as its add finishes, and all new CIDs go into this peer's file index with one
+    batched write at the end, see _add_many_to_file_index().
+
+    :param file_paths: Paths of the files on the user's local machine
+    :param replication_min: See upload_file()
+    :param replication_max: See upload_file()
+    :param on_stage: Optional callback on_stage(stage, results=...), called with 'added' once every add has
+                     finished, then with 'indexed' if every file was indexed, 'partial' if only some were
+                     or 'failed' (with an error) if none was, see upload_jobs.py
+    :return A list with one {'file_name', 'cid', 'status', 'error'} per file, in the order of file_paths.
+            status is 'indexed' or 'failed'.
+    """
+    results = [{'file_name': os.path.basename(path), 'cid': None, 'status': 'failed', 'error': None} for path in file_paths]
+    infos = {}
+
+    def add(index):
+        path = file_paths[index]
+        try:
+            info = _file_info(path)
+            cid = _add_to_cluster(path, replication_min, replication_max)
+            if not cid:
+                results[index]['error'] = "Failed to add file to IPFS Cluster"
+                return
+            _mark_uploaded(cid)
+        except Exception as e:
+            results[index]['error'] = str(e)
+            return
+        results[index]['cid'] = cid
+        infos[cid] = info
+
+    with ThreadPoolExecutor(max_workers=max(1, min(batch_upload_workers, len(file_paths)))) as pool:
+        list(pool.map(add, range(len(file_paths))))
+    if on_stage is not None:
+        on_stage('added', results=results)
+
+    if infos:
+        try:
+            _add_many_to_file_index(my_ipfs_cluster_id, infos)
+        except Exception as e:
+            for result in results:
+                if result['cid']:
+                    result['error'] = f"Added to the cluster, but the file index update failed: {e}"
+        else:
+            for result in results:
+                if result['cid']:
+                    result['status'] = 'indexed'
+    if on_stage is not None:
+        indexed = sum(result['status'] == 'indexed' for result in results)
+        if indexed == len(results):
+            on_stage('indexed', results=results)
+        elif indexed:
+            on_stage('partial', results=results, error=f"{len(results) - indexed} of {len(results)} files failed")
+        else:
+            on_stage('failed', results=results, error="No file was uploaded")
+    return results
+
+
+class _CountingReader:
+    """
+    Passes read() through to a stream and counts the bytes
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.size += len(chunk)
+        return chunk
+
+
+def upload_stream(stream, file_name: str, replication_min: int = None, replication_max: int = None):
+    """
+    Uploads the content of a binary stream without a file on disk, for example an HTTP request body.
+    The stream is piped into the cluster add request in ipfs_cluster.upload_chunk_size chunks, its size
+    is counted on the way. Unlike upload_file(), the CID is only known after the transfer, so already
+    pinned content is sent again and the content is not put in the local blob cache.
+
+    :param stream: Object with read(size)
+    :param file_name: Name of the file, stored in the file record
+    :param replication_min: See upload_file()
+    :param replication_max: See upload_file()
+    :return: {"cid": CID, "file_size": bytes} if successful, otherwise None
+    """
+    reader = _CountingReader(stream)
+    file_name = os.path.basename(file_name)
+    cid = ipfs.add_stream_to_cluster(reader, file_name, replication_min=replication_min, replication_max=replication_max)
+    if not cid:
+        return None
+
+    new_file_info = {'file_name': file_name, 'file_size': reader.size, 'timestamp': datetime.now().strftime("%Y-%m-%d")}
+    _record_upload(cid, new_file_info)
+    return {'cid': cid, 'file_size': reader.size}
+
+
+def upload_directory(dir_path: str, replication_min: int = None, replication_max: int = None, on_stage=None):
+    """
+    Uploads a directory tree as one DAG under a single root CID, in one request to the cluster.
+    Only the root is added to this peer's file index, its files are listed in a manifest
+    stored under "<ROOT_CID> DIR", see get_directory_manifest().
+
+    :param dir_path: The directory path on user's local machine
+    :param replication_min: See upload_file()
+    :param replication_max: See upload_file()
+    :param on_stage: See upload_file()
+    :return The root CID of the directory, or None if the cluster add failed
+    """
+    added = ipfs.add_directory_to_cluster(dir_path, replication_min=replication_min, replication_max=replication_max)
+    if not added:
+        return None
+    cid, files = added
+    if on_stage is not None:
+        on_stage('added', cid=cid)
+
+    # The manifest is written first, an indexed directory always has its listing
+    kv.set_kv(_directory_key(cid), kv.encode_value(kv.DIRECTORY_MANIFEST, files))
+    new_file_info = {'file_name': os.path.basename(os.path.normpath(dir_path)) + "/",
+                     'file_size': sum(entry['size'] for entry in files),
+                     'timestamp': datetime.now().strftime("%Y-%m-%d")}
+    _record_upload(cid, new_file_info)
+    if on_stage is not None:
+        on_stage('indexed', cid=cid)
+    return cid
+
+
+def get_directory_manifest(cid: str):
+    """
+    Lists the files of a directory uploaded with upload_directory()
+
+    :return: [{'path': path relative to the directory, 'cid': CID, 'size': bytes}], or None if cid is not a directory
+    """
+    return kv.decode_value(kv.DIRECTORY_MANIFEST, kv.get_kv(_directory_key(cid)))
+
+
+def is_directory(cid: str, metadata: dict = None) -> bool:
+    """
+    Whether cid is the root of a directory uploaded with upload_directory(). The gateway answers those
+    with an HTML listing instead of file content.
+
+    :param metadata: The file record of cid if the caller already has it, see get_file_metadata()
+    """
+    if metadata is None:
+        metadata = get_file_metadata(cid)
+    if metadata:
+        return metadata.get('file_name', '').endswith("/")
+    return get_directory_manifest(cid) is not None
+
 
 def download_file(cid: str, file_path: str):
     """
     This function will download file with cid to file_path
+    CIDs already in the local blob cache are copied from disk instead of fetched from a gateway,
+    see blob_cache.py
     :param cid: The file CID that user wants to download
     :param file_path: The file path where user wants to save the file(include file name suche like test.txt)
     """
-    return ipfs.download_file_from_ipfs(cid, file_path)
+    cache = blob_cache.get_cache()
+    if cache and cache.get(cid, file_path):
+        return {"success": True, "message": f"File served from the local cache and saved to {file_path}"}
+
+    result = ipfs.download_file_from_ipfs(cid, file_path)
+    if cache and result['success']:
+        cache.put(cid, file_path)
+    return result
+
+
+def get_file_metadata(cid: str):
+    """
+    Looks up the stored file record of a CID, from any peer that uploaded it.
+    Peers that have not been migrated to the per-file layout are read from their legacy blob.
+
+    :return: {'file_name': str, 'file_size': int, ...}, or None if no record is found
+    """
+    peers = kv.decode_value(kv.DELETION_RECORD, kv.get_kv(cid), {}).get(cid, {})
+    # This peer's own record first, it is most likely cached
+    peers = sorted(peers, key=lambda peer: peer != my_ipfs_cluster_id)
+    records = kv.get_many([_file_key(peer, cid) for peer in peers] + [_index_key(peer) for peer in peers])
+    for peer in peers:
+        record = kv.decode_value(kv.FILE_RECORD, records[_file_key(peer, cid)])
+        if record is not None:
+            record.pop('segment', None)
+            return record
+
+    legacy_peers = [peer for peer in peers if _parse_json(records[_index_key(peer)], None) is None]
+    legacy_structures = kv.get_many(legacy_peers)
+    for peer in legacy_peers:
+        record = _parse_file_structure(legacy_structures[peer]).get(cid)
+        if record is not None:
+            return record
+    return None
+
+
+def stream_file(cid: str, start: int = 0, end: int = None, chunk_size: int = 256 * 1024):
+    """
+    Yields bytes [start, end] of a file in chunk_size pieces, from the local blob cache when it has the CID
+    and from the fastest gateway otherwise. Memory use does not depend on the file size.
+    Gateway errors are raised from the first next().
+
+    :param cid: The CID of the file
+    :param start: First byte
+    :param end: Last byte, inclusive, None for the end of the file
+    """
+    remaining = None if end is None else end - start + 1
+    cache = blob_cache.get_cache()
+    blob = cache.open(cid, remaining) if cache else None
+    if blob is not None:
+        with blob:
+            blob.seek(start)
+            while remaining is None or remaining > 0:
+                chunk = blob.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        return
+
+    response = ipfs.open_gateway_stream(cid, start if start or end is not None else None, end)
+    with response:
+        if response.status_code not in (200, 206):
+            raise requests.exceptions.HTTPError(f"Gateway answered {response.status_code} for {cid}", response=response)
+        # A gateway without Range support sends the whole file, drop the bytes before start
+        skip = start if response.status_code == 200 else 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            if chunk:
+                yield chunk
+            if remaining == 0:
+                return
+
+
+def get_blob_cache_stats():
+    """
+    :return: Hit ratio, bytes saved and size of the local blob cache
+    """
+    return blob_cache.cache_stats()
 
 
 def get_all_peers():
@@ -212,6 +708,14 @@ def get_all_pinned_file():
     return ipfs.list_pinned_files()
 
 
+def iter_pinned_files(status=None, cids=None, peer=None):
+    """
+    Same entries as get_all_pinned_file(), parsed one at a time while the cluster streams them.
+    See ipfs_cluster.iter_pinned_files() for the filters.
+    """
+    return ipfs.iter_pinned_files(status, cids, peer)
+
+
 def get_file_status(cid: str):
     """
     This function will return file info of a certain file
@@ -254,12 +758,25 @@ def get_other_peer_file_structure(peer_id: str):
     :return format: Same as my_file_structure in upload_file(). If return an empty dict {} means this user hasn't upload
                     any files yet
     """
-    peer_file_structure = kv.get_kv(peer_id)
+    return _load_file_structures([peer_id])[peer_id]
+
+
+def _parse_file_structure(raw: str) -> dict:
     try:
-        peer_file_structure = json.loads(peer_file_structure)
+        return json.loads(raw)
     except:
-        peer_file_structure = {}
-    return peer_file_structure
+        return {}
+
+
+def _get_live_cids(all_files: dict) -> set:
+    """
+    Return the CIDs that still have a deletion record, fetched with a single batched KV read
+
+    :param all_files: The output of _load_file_structures()
+    """
+    cids = [cid for files in all_files.values() if files for cid in files]
+    cid_data = kv.get_many(cids)
+    return {cid for cid, data in cid_data.items() if kv.decode_value(kv.DELETION_RECORD, data)}
 
 
 def get_all_file():
@@ -282,17 +799,15 @@ def get_all_file():
                     }
     """
     peers = get_all_peers()["cluster_peers"]
-    all_files = {}
-    for peer in peers:
-        all_files[peer] = get_other_peer_file_structure(peer)
+    all_files = _load_file_structures(peers)
+    live_cids = _get_live_cids(all_files)
 
     unique_files = {}
 
     for peer_id, files in all_files.items():
         if files:  
             for cid, file_info in files.items():
-                cid_data = kv.get_kv(cid)
-                if cid not in unique_files and  cid_data and cid_data != "{}":
+                if cid not in unique_files and cid in live_cids:
                     unique_files[cid] = {
                         'peerID': peer_id,
                         'fileName': file_info.get('file_name'),
@@ -323,18 +838,13 @@ def add_favorite_peer(peer_id: str, nickname: str) -> dict:
                                         },
                     }
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
     peer_name = ipfs.get_peer_name(peer_id)
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        my_favorite_list = {}
 
-    my_favorite_list[peer_id] = {'nickname': nickname, 'peer_name': peer_name}
+    def add(my_favorite_list):
+        my_favorite_list[peer_id] = {'nickname': nickname, 'peer_name': peer_name}
+        return my_favorite_list
 
-    kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
-    return my_favorite_list
+    return kv.update(my_ipfs_cluster_id + " FAVORITE", add, kind=kv.FAVORITES, default={})
 
 
 def change_nickname(peer_id: str, new_nickname: str) -> dict:
@@ -348,17 +858,14 @@ def change_nickname(peer_id: str, new_nickname: str) -> dict:
     :return format: Please follow add_favorite_peer() return format
     """
 
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        return {}
-
-    my_favorite_list[peer_id]['nickname'] = new_nickname
-    kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
+    def rename(my_favorite_list):
+        if not my_favorite_list:
+            print("Your favorite peer list is currently empty or broken, creating a new one.")
+            return kv.UNCHANGED
+        my_favorite_list[peer_id]['nickname'] = new_nickname
+        return my_favorite_list
 
-    return my_favorite_list
+    return kv.update(my_ipfs_cluster_id + " FAVORITE", rename, kind=kv.FAVORITES, default={})
 
 
 def remove_favorite_peer(peer_id) -> dict:
@@ -370,21 +877,15 @@ def remove_favorite_peer(peer_id) -> dict:
     :return a python dict after modification
     :return format: Please follow add_favorite_peer() return format
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-    except:
-        print("Your favorite peer list is currently empty or broken, creating a new one.")
-        return {}
-
-    try:
+    def remove(my_favorite_list):
+        if peer_id not in my_favorite_list:
+            print(f"{peer_id} not found.")
+            return kv.UNCHANGED
         del my_favorite_list[peer_id]
-        kv.set_kv(my_ipfs_cluster_id + " FAVORITE", json.dumps(my_favorite_list))
-        return my_favorite_list
-    except:
-        print(f"{peer_id} not found.")
         return my_favorite_list
 
+    return kv.update(my_ipfs_cluster_id + " FAVORITE", remove, kind=kv.FAVORITES, default={})
+
 
 def get_my_favorite_peer() -> dict:
     """
@@ -394,78 +895,80 @@ def get_my_favorite_peer() -> dict:
     :return a python dict after modification
     :return format: Please follow add_favorite_peer() return format
     """
-    my_favorite_list = kv.get_kv(my_ipfs_cluster_id + " FAVORITE")
-    try:
-        my_favorite_list = json.loads(my_favorite_list)
-        return my_favorite_list
-    except:
+    my_favorite_list = kv.decode_value(kv.FAVORITES, kv.get_kv(my_ipfs_cluster_id + " FAVORITE"))
+    if my_favorite_list is None:
         print("Your favorite peer list is currently empty or broken, creating a new one.")
         return {}
+    return my_favorite_list
 
 def delete_file(cid:str) -> str:
     global my_ipfs_cluster_id
-    delete_file_structure = kv.get_kv(cid)
-    try:
-        parsed = json.loads(delete_file_structure)
-        
-        result = {}
-        for outer_key, inner_dict in parsed.items():
-            result[outer_key] = {}
-            for inner_key, value in inner_dict.items():
-                result[outer_key][inner_key] = value
-        
-        delete_file_structure = result
-    except json.JSONDecodeError:
-        if delete_file_structure != "":
-            print("Delete File structure is not valid JSON")
-        delete_file_structure = {}
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        delete_file_structure = {}
-
+    delete_file_structure = kv.decode_value(kv.DELETION_RECORD, kv.get_kv(cid, fresh=True), {})
 
     if cid not in delete_file_structure:
         return f"File with CID {cid} not found"
     
     if my_ipfs_cluster_id not in delete_file_structure[cid]:
         return f"Peer {my_ipfs_cluster_id} does not have access to this file for deletion"
-    delete_file_structure[cid][my_ipfs_cluster_id] = True
+
+    def mark_deleted(delete_file_structure):
+        if my_ipfs_cluster_id not in delete_file_structure.get(cid, {}):
+            return kv.UNCHANGED
+        delete_file_structure[cid][my_ipfs_cluster_id] = True
+        return delete_file_structure
+
+    def drop(delete_file_structure):
+        if cid not in delete_file_structure:
+            return kv.UNCHANGED
+        del delete_file_structure[cid]
+        return delete_file_structure
+
     try:
-        kv.set_kv(cid, json.dumps(delete_file_structure))
+        delete_file_structure = kv.update(cid, mark_deleted, kind=kv.DELETION_RECORD, default={})
     except Exception as e:
         return f"Error updating ResilientDB: {str(e)}"
-    peer_values = delete_file_structure[cid]
+    peer_values = delete_file_structure.get(cid, {})
     
-    all_peers_true = all(value for value in peer_values.values())
+    all_peers_true = bool(peer_values) and all(value for value in peer_values.values())
     if all_peers_true:
         try:
-            ipfs.remove_file_from_cluster(cid)
-            
-            del delete_file_structure[cid]
-            
-            kv.set_kv(cid, json.dumps(delete_file_structure))
-            file_structure = kv.get_kv(my_ipfs_cluster_id)
+            file_record = kv.decode_value(kv.FILE_RECORD, kv.get_kv(_file_key(my_ipfs_cluster_id, cid)), {})
+            ipfs.remove_file_from_cluster(cid, file_record.get('file_size', 0))
             
+            kv.update(cid, drop, kind=kv.DELETION_RECORD, default={})
+            if file_record.get('file_name', '').endswith("/"):
+                kv.set_kv(_directory_key(cid), "")
             try:
-                peer_file_structure = json.loads(file_structure) if file_structure else {}
-                
-                if cid in peer_file_structure:
-                    del peer_file_structure[cid]
-                
-                kv.set_kv(my_ipfs_cluster_id, json.dumps(peer_file_structure))
-                
-                print(f"Successfully deleted file with CID {cid}")
-                return "File deleted successfully"
-            
-            except json.JSONDecodeError:
-                print("Error parsing peer file structure")
+                _remove_from_file_index(my_ipfs_cluster_id, cid)
+            except Exception as e:
+                print(f"Error updating peer file index: {e}")
                 return "Partial deletion: File removed from cluster, but local structure update failed"
 
+            print(f"Successfully deleted file with CID {cid}")
+            return "File deleted successfully"
+
         except Exception as e:
             return f"Error deleting file: {str(e)}"
     else:
         return "Cannot delete file: Not all peers have marked it as True"
     
+
+def get_gc_state():
+    """
+    :return: Unpins waiting for the next cluster-wide garbage collection, see ipfs_cluster.GCScheduler
+    """
+    return ipfs.get_gc_scheduler().state()
+
+
+def run_gc_now():
+    """
+    Runs the cluster-wide garbage collection for all pending unpins without waiting for the schedule
+
+    :return: True if the GC succeeded or nothing was pending
+    """
+    return ipfs.get_gc_scheduler().flush()
+
+
 def fetch_dashboard_data():
     """
     Retrieve comprehensive file and peer statistics for dashboard.
@@ -499,7 +1002,6 @@ def fetch_dashboard_data():
 
     """
     peers = get_all_peers()["cluster_peers"]
-    all_files = {}
     unique_files = {}
     
     stats = {
@@ -513,16 +1015,14 @@ def fetch_dashboard_data():
         'files_with_timestamp': [],
         'peer_cid_array': []
     }
-    for peer in peers:
-        all_files[peer] = get_other_peer_file_structure(peer)
+    all_files = _load_file_structures(peers)
+    live_cids = _get_live_cids(all_files)
     unique_peer_ids = set()
 
     for peer_id, files in all_files.items():
         if files:
             for cid, file_info in files.items():
-                cid_data = kv.get_kv(cid)
-                
-                if cid not in unique_files and cid_data and cid_data != "{}":
+                if cid not in unique_files and cid in live_cids:
                     file_name = file_info.get('file_name', '')
                     
                     file_type = get_file_type(file_name)
@@ -1,6 +1,14 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import client
+import functools
+import json
+import mimetypes
 import os
+import re
+import shutil
+import tempfile
+import upload_jobs
+from urllib.parse import quote
 from datetime import datetime
 from flask_cors import CORS
 
@@ -17,43 +25,152 @@ CORS(app)
 TEMP_UPLOAD_FOLDER = "temp_uploads"
 os.makedirs(TEMP_UPLOAD_FOLDER, exist_ok=True)
 
+def _replication_args(data):
+    # Optional replication_min / replication_max fields of an upload request
+    return {key: int(data[key]) for key in ('replication_min', 'replication_max') if data.get(key) not in (None, '')}
+
+
+def _queue_full_response(e):
+    response = jsonify({"error": f"Upload queue is full: {e}"})
+    response.headers['Retry-After'] = '5'
+    return response, 429
+
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    """
+    Queues an upload and answers 202 with a job id right away, poll /jobs/<id> for its progress.
+    Several 'files' fields are uploaded as one batch job, see client.upload_files(), and the job status
+    then has one result per file.
+    Answers 429 when the upload queue is full, see upload_jobs.py for the settings.
+    """
+    jobs = upload_jobs.get_queue()
+    if jobs.wait == 0 and jobs.full():
+        # Refuse before the file is written to disk
+        return _queue_full_response(f"{jobs.max_queued} uploads are already waiting")
     try:
-        # Check if a file is part of the request
-        if 'files' in request.files:
-            uploaded_file = request.files['files']
+        uploaded_files = request.files.getlist('files')
+        # A batch of files goes through one job and one file index write
+        if len(uploaded_files) > 1:
+            temp_dir = tempfile.mkdtemp(dir=TEMP_UPLOAD_FOLDER)
+            temp_paths = []
+            try:
+                for i, uploaded_file in enumerate(uploaded_files):
+                    # One folder per file keeps the original name even when two files share it
+                    os.makedirs(os.path.join(temp_dir, str(i)))
+                    temp_paths.append(os.path.join(temp_dir, str(i), os.path.basename(uploaded_file.filename)))
+                    uploaded_file.save(temp_paths[-1])
+            except Exception:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+
+            job = jobs.submit(functools.partial(client.upload_files, temp_paths, **_replication_args(request.form)),
+                              {'file_names': [os.path.basename(path) for path in temp_paths]},
+                              cleanup=functools.partial(shutil.rmtree, temp_dir, ignore_errors=True))
 
-            # Save the file temporarily
-            temp_path = os.path.join(TEMP_UPLOAD_FOLDER, uploaded_file.filename)
-            uploaded_file.save(temp_path)
-
-            # Simulate processing the file via its temporary path
-            client.upload_file(temp_path)
-
-            # Remove the temporary file
-            os.remove(temp_path)
-            return jsonify({"status": "File uploaded successfully", "temp_path": temp_path}), 200
+        # Check if a file is part of the request
+        elif uploaded_files:
+            uploaded_file = uploaded_files[0]
+            file_name = os.path.basename(uploaded_file.filename)
+
+            # Save the file temporarily, in its own folder so parallel uploads of the same name do not collide
+            temp_dir = tempfile.mkdtemp(dir=TEMP_UPLOAD_FOLDER)
+            temp_path = os.path.join(temp_dir, file_name)
+            try:
+                uploaded_file.save(temp_path)
+            except Exception:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+
+            # The worker removes the temporary file once the upload has finished or failed
+            job = jobs.submit(functools.partial(client.upload_file, temp_path, **_replication_args(request.form)),
+                              {'file_name': file_name},
+                              cleanup=functools.partial(shutil.rmtree, temp_dir, ignore_errors=True))
 
         # If no file, check for a file path in JSON data
-        elif request.json and 'file_path' in request.json:
+        elif request.is_json and request.json and 'file_path' in request.json:
             file_path = request.json.get('file_path')
-            client.upload_file(file_path)
-            return jsonify({"status": "File uploaded successfully"}), 200
+            job = jobs.submit(functools.partial(client.upload_file, file_path, **_replication_args(request.json)),
+                              {'file_name': os.path.basename(file_path)})
 
         # If neither file nor path is provided, return an error
         else:
             return jsonify({"error": "No file or file path provided"}), 400
 
+    except upload_jobs.QueueFull as e:
+        return _queue_full_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-        
+    return jsonify({"status": "Upload queued", "job_id": job['id'], "status_url": f"/jobs/{job['id']}"}), 202
+
+
+@app.route('/jobs/<string:job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    job = upload_jobs.get_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/jobs', methods=['GET'])
+def get_upload_jobs_stats():
+    return jsonify(upload_jobs.get_queue().stats()), 200
+
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    Uploads the raw request body as one file, without a temporary copy on disk.
+    The file name comes from ?filename= or the X-Filename header,
+    replication from ?replication_min= and ?replication_max=.
+    """
+    filename = request.args.get('filename') or request.headers.get('X-Filename')
+    if not filename:
+        return jsonify({"error": "No filename provided"}), 400
+    try:
+        result = client.upload_stream(request.stream, filename, **_replication_args(request.args))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if result is None:
+        return jsonify({"error": "Failed to add file to IPFS Cluster"}), 502
+    return jsonify({"status": "File uploaded successfully", **result}), 200
+
+
+
+@app.route('/upload/directory', methods=['POST'])
+def upload_directory():
+    """
+    Queues the upload of a local directory, given as {"dir_path": ...}, as one DAG under a single root CID.
+    Answers 202 with a job id like /upload, the job's cid is the root. See client.upload_directory().
+    """
+    data = request.json if request.is_json else None
+    dir_path = data.get('dir_path') if data else None
+    if not dir_path or not os.path.isdir(dir_path):
+        return jsonify({"error": "No directory path provided"}), 400
+    try:
+        job = upload_jobs.get_queue().submit(
+            functools.partial(client.upload_directory, dir_path, **_replication_args(data)),
+            {'file_name': os.path.basename(os.path.normpath(dir_path)) + "/"})
+    except upload_jobs.QueueFull as e:
+        return _queue_full_response(e)
+    return jsonify({"status": "Upload queued", "job_id": job['id'], "status_url": f"/jobs/{job['id']}"}), 202
+
+
+@app.route('/directory/<string:cid>', methods=['GET'])
+def get_directory(cid):
+    files = client.get_directory_manifest(cid)
+    if files is None:
+        return jsonify({"error": f"{cid} is not an uploaded directory"}), 404
+    return jsonify({"cid": cid, "files": files}), 200
+
 
 @app.route('/download', methods=['POST'])
 def download_file():
     data = request.json
     cid = data.get('cid')
+    if client.is_directory(cid):
+        return _directory_response(cid)
     home_dir = os.path.expanduser('~')
     
     downloads_folder = os.path.join(home_dir, 'Downloads')
@@ -72,6 +189,90 @@ def download_file():
     else:
         return jsonify({"status": "failure", "message": result['message']}), 500
 
+def _directory_response(cid):
+    return jsonify({"error": f"{cid} is a directory, list its files with /directory/{cid}",
+                    "directory_url": f"/directory/{cid}"}), 400
+
+
+def _parse_range(header, size):
+    """
+    Parses a single-range Range header, such as bytes=0-499, bytes=500- or bytes=-500.
+
+    :return: (start, end) inclusive, or None to send the whole file. Invalid headers, such as bytes=5-3,
+             are ignored as RFC 7233 asks.
+    :raises ValueError: If the range is valid but starts past the end of the file
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        # Missing, malformed or multi-range requests get the whole file
+        return None
+    if match.group(1) == '':
+        length = int(match.group(2))
+        if length == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(match.group(1))
+    if match.group(2) and int(match.group(2)) < start:
+        # last-byte-pos before first-byte-pos makes the header invalid, not unsatisfiable
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    return start, end
+
+
+@app.route('/download/<string:cid>', methods=['GET'])
+def stream_download(cid):
+    """
+    Sends a file to the caller as it is read from the gateway or the local blob cache, nothing is written
+    to this server's disk. Supports Range and If-Range so players can seek and browsers can resume.
+    The ETag is the CID, which never changes for the same content.
+    ?download=1 asks the browser to save the file instead of showing it.
+    Directory roots are answered with 400, their files are listed by /directory/<cid>.
+    """
+    metadata = client.get_file_metadata(cid) or {}
+    if client.is_directory(cid, metadata):
+        return _directory_response(cid)
+    file_name = metadata.get('file_name') or cid
+    size = metadata.get('file_size')
+    etag = f'"{cid}"'
+
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Content-Type': mimetypes.guess_type(file_name)[0] or 'application/octet-stream',
+        'Content-Disposition': f"{'attachment' if request.args.get('download') else 'inline'}; filename*=UTF-8''{quote(file_name)}",
+    }
+    status, start, end = 200, 0, None
+    if size is not None:
+        headers['Accept-Ranges'] = 'bytes'
+        if_range = request.headers.get('If-Range')
+        try:
+            byte_range = _parse_range(request.headers.get('Range'), size) if if_range in (None, etag) else None
+        except ValueError:
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        if byte_range is not None:
+            status, (start, end) = 206, byte_range
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        headers['Content-Length'] = str((size - 1 if end is None else end) - start + 1)
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers)
+
+    chunks = client.stream_file(cid, start, end)
+    try:
+        first = next(chunks, b'')
+    except Exception as e:
+        return jsonify({"status": "failure", "message": f"Error downloading file from IPFS: {e}"}), 502
+
+    def generate():
+        yield first
+        yield from chunks
+
+    return Response(stream_with_context(generate()), status=status, headers=headers)
+
+
 @app.route('/peers', methods=['GET'])
 def get_all_peers():
     peers = client.get_all_peers()
@@ -79,8 +280,27 @@ def get_all_peers():
 
 @app.route('/pinned_files', methods=['GET'])
 def get_all_pinned_files():
-    pinned_files = client.get_all_pinned_file()
-    return jsonify(pinned_files), 200
+    # Optional filters: ?status=pinned,pinning&cids=CID1,CID2&peer=PEER_ID
+    status = request.args.get('status')
+    cids = request.args.get('cids')
+    pins = client.iter_pinned_files(status=status.split(',') if status else None,
+                                    cids=cids.split(',') if cids else None,
+                                    peer=request.args.get('peer'))
+    try:
+        first = next(pins, None)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    def generate():
+        # Same JSON array as before, written one pin at a time
+        yield '['
+        if first is not None:
+            yield json.dumps(first)
+            for pin in pins:
+                yield ',' + json.dumps(pin)
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
 
 @app.route('/file_status/<string:cid>', methods=['GET'])
 def get_file_status(cid):
@@ -227,5 +447,23 @@ def get_dashboard_stats():
     dashboard_data = client.fetch_dashboard_data()
     
     return jsonify({"data": dashboard_data}), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(client.get_blob_cache_stats()), 200
+
+
+@app.route('/gc', methods=['GET'])
+def get_gc_state():
+    return jsonify(client.get_gc_state()), 200
+
+
+@app.route('/gc/flush', methods=['POST'])
+def flush_gc():
+    if client.run_gc_now():
+        return jsonify({"status": "success", "gc": client.get_gc_state()}), 200
+    return jsonify({"status": "failure", "gc": client.get_gc_state()}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,8 +1,92 @@
+import codecs
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus, urlparse
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import unixfs
 
 ipfs_cluster_api_url = None
 ipfs_gateway_url = None
 
+# Shared HTTP session settings, see get_session()
+pool_size = 16
+retry_total = 3
+retry_backoff = 0.5
+
+# (connect, read) timeout in seconds for each kind of call
+timeouts = {
+    'add': (5, 600),
+    'pin': (5, 60),
+    'unpin': (5, 60),
+    'status': (5, 30),
+    'pins': (5, 120),
+    'peers': (5, 30),
+    'id': (5, 10),
+    'gc': (5, 600),
+    'gateway': (5, 10),
+}
+
+# Requests in flight at once for pin_many(), unpin_many() and status_many()
+bulk_workers = 8
+
+# Bytes read from disk and sent per chunk when streaming an upload
+upload_chunk_size = 1024 * 1024
+
+# DAG settings for /add, pinned explicitly so unixfs.compute_cid() predicts the CID the cluster assigns
+add_params = {
+    'cid-version': '0',
+    'raw-leaves': 'false',
+    'chunker': f'size-{unixfs.CHUNK_SIZE}',
+    'layout': 'balanced',
+}
+
+# Ranged download settings, see download_file_from_ipfs()
+download_segment_size = 8 * 1024 * 1024
+download_workers = 4
+download_segment_attempts = 3
+
+# Gateway selection: a second gateway is asked if the first has not answered after hedge_delay seconds.
+# Each gateway's time to first byte is tracked as an EWMA with weight gateway_ewma_alpha for new samples.
+hedge_delay = 0.3
+gateway_ewma_alpha = 0.3
+gateway_latency = {}
+_gateway_latency_lock = threading.Lock()
+
+# Seconds the peers pinning a CID are remembered, so consecutive downloads and Range requests of the
+# same CID skip the cluster-wide status call. At most pinned_peers_max_entries CIDs are kept.
+pinned_peers_ttl = 30.0
+pinned_peers_max_entries = 4096
+_pinned_peers = OrderedDict()
+_pinned_peers_lock = threading.Lock()
+
+# Seconds between background refreshes of the peer directory, see PeerDirectory
+peer_refresh_interval = 30.0
+
+# Cluster-wide GC after unpins, see GCScheduler. GC runs once no unpin arrived for gc_debounce seconds,
+# once gc_freed_bytes_threshold bytes are waiting to be freed, or gc_max_delay seconds after the first
+# pending unpin, whichever comes first.
+gc_debounce = 30.0
+gc_freed_bytes_threshold = 1024 * 1024 * 1024
+gc_max_delay = 300.0
+
+_session = None
+_session_lock = threading.Lock()
+_peer_directory = None
+_gc_scheduler = None
+# Peer ID of the cluster peer behind ipfs_cluster_api_url, see _local_peer_id()
+_my_peer_id = None
+
 
 def read_config_file():
     """
@@ -15,22 +99,137 @@ def read_config_file():
         ipfs_gateway_url = f.readline().strip()
 
 
-def add_file_to_cluster(file_path):
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide HTTP session used for every cluster and gateway call.
+    Connections are kept alive and pooled per host. Idempotent requests (GET, HEAD, DELETE)
+    are retried with exponential backoff on connection errors and 502/503/504 responses.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=retry_total,
+                    backoff_factor=retry_backoff,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD', 'DELETE', 'OPTIONS']),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _request(method, endpoint, url, **kwargs):
+    """
+    Sends a request through the shared session with the timeout configured for endpoint.
+    """
+    kwargs.setdefault('timeout', timeouts[endpoint])
+    return get_session().request(method, url, **kwargs)
+
+
+def _multipart_body(parts, boundary, progress=None, total=None):
+    """
+    Generates a multipart/form-data body one chunk at a time, so memory use does not depend on the file size.
+    requests sends a generator body with chunked transfer encoding.
+
+    :param parts: Iterable of (filename, file object, content type), the file object may be None for an empty part
+    :param boundary: The multipart boundary, also used in the Content-Type header
+    :param progress: Optional callback progress(bytes_sent, total) called after every chunk
+    :param total: Total bytes expected, passed through to progress
+    """
+    sent = 0
+    for filename, fileobj, content_type in parts:
+        # Same escaping as requests uses for the filename parameter
+        filename = filename.replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+               f'Content-Type: {content_type}\r\n\r\n').encode()
+        if fileobj is not None:
+            while True:
+                chunk = fileobj.read(upload_chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                yield chunk
+                if progress is not None:
+                    progress(sent, total)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def _post_multipart(endpoint, url, parts, progress=None, total=None, params=None):
+    boundary = uuid.uuid4().hex
+    body = _multipart_body(parts, boundary, progress, total)
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    return _request("POST", endpoint, url, data=body, headers=headers, params=params)
+
+
+def _added_entries(response):
+    """
+    Parses the output of /add, which is one JSON object per added file or directory,
+    either as newline-delimited JSON or as a JSON array.
+    """
+    text = response.text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _entry_cid(entry):
+    cid = entry['cid']
+    return cid['/'] if isinstance(cid, dict) else cid
+
+
+def _replication_params(replication_min=None, replication_max=None):
+    params = {}
+    if replication_min is not None:
+        params['replication-min'] = str(replication_min)
+    if replication_max is not None:
+        params['replication-max'] = str(replication_max)
+    return params
+
+
+def add_file_to_cluster(file_path, progress=None, replication_min=None, replication_max=None):
     """
     Adds a file to the IPFS Cluster.
+    The file is streamed from disk in upload_chunk_size chunks and closed when the upload ends.
 
     :param file_path: The path to the file to be added.
+    :param progress: Optional callback progress(bytes_sent, total_bytes).
+    :param replication_min: Minimum number of peers pinning the file, the cluster default if None.
+    :param replication_max: Maximum number of peers pinning the file, the cluster default if None.
     :return: The CID (Content Identifier) of the file if successful, otherwise None.
     """
+    with open(file_path, 'rb') as f:
+        return add_stream_to_cluster(f, os.path.basename(file_path), progress, replication_min, replication_max,
+                                     total=os.path.getsize(file_path))
+
+
+def add_stream_to_cluster(stream, filename, progress=None, replication_min=None, replication_max=None, total=None):
+    """
+    Adds the content of a readable binary stream to the IPFS Cluster, such as an incoming HTTP request body.
+    The stream is read once, upload_chunk_size bytes at a time, and is not closed.
+
+    :param stream: Object with read(size), read until it returns b"".
+    :param filename: Name sent to the cluster with the content.
+    :param total: Size of the content if known, only passed through to progress.
+    :return: The CID (Content Identifier) of the content if successful, otherwise None.
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
     url = ipfs_cluster_api_url + "add"
-    files = {'file': open(file_path, 'rb')}
-    response = requests.post(url, files=files)
+    params = dict(add_params, **_replication_params(replication_min, replication_max))
+    parts = [(filename, stream, 'application/octet-stream')]
+    response = _post_multipart('add', url, parts, progress, total, params=params)
 
     if response.status_code == 200:
-        cid = response.json()['cid']['/']
+        cid = _entry_cid(_added_entries(response)[-1])
         print(f"File added successfully with CID: {cid}")
         return cid
     else:
@@ -38,29 +237,109 @@ def add_file_to_cluster(file_path):
         print(response.text)
 
 
-def pin_file(cid, replication_min, replication_max):
+def _walk_directory(dir_path):
+    """
+    Lists a directory tree depth-first, each directory directly followed by everything inside it,
+    which is the order the cluster's multipart reader expects. Symlinks are skipped.
+
+    :return: [(relative path, absolute path, size in bytes or None for a directory)]
+    """
+    entries = []
+    for root, dirs, files in os.walk(dir_path):
+        dirs[:] = sorted(d for d in dirs if not os.path.islink(os.path.join(root, d)))
+        relative_root = os.path.relpath(root, dir_path).replace(os.sep, '/')
+        prefix = '' if relative_root == '.' else relative_root + '/'
+        if prefix:
+            entries.append((relative_root, root, None))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                entries.append((prefix + name, path, os.path.getsize(path)))
+    return entries
+
+
+def _directory_parts(entries):
+    # Opens one file at a time, _multipart_body() reads each part to the end before asking for the next
+    for relative_path, path, size in entries:
+        # The cluster URL-unescapes multipart file names, as go-ipfs-files escapes them
+        name = quote_plus(relative_path)
+        if size is None:
+            yield name, None, 'application/x-directory'
+        else:
+            with open(path, 'rb') as f:
+                yield name, f, 'application/octet-stream'
+
+
+def add_directory_to_cluster(dir_path, progress=None, replication_min=None, replication_max=None):
+    """
+    Adds a directory tree to the IPFS Cluster in one streaming multipart request, wrapped in a directory
+    node whose CID is returned as the root. Files are read one at a time in upload_chunk_size chunks.
+
+    :param dir_path: The directory to be added.
+    :param progress: Optional callback progress(bytes_sent, total_bytes).
+    :return: (root CID, [{'path': relative path, 'cid': CID, 'size': bytes}] for every file),
+             or None if the add failed or the directory has no entries.
+    """
+    if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
+        read_config_file()
+
+    entries = _walk_directory(dir_path)
+    if not entries:
+        print(f"Nothing to add in {dir_path}")
+        return None
+
+    url = ipfs_cluster_api_url + "add"
+    params = dict(add_params, **_replication_params(replication_min, replication_max))
+    params['wrap-with-directory'] = 'true'
+    total = sum(size for _, _, size in entries if size is not None)
+    try:
+        response = _post_multipart('add', url, _directory_parts(entries), progress, total, params=params)
+    except requests.exceptions.RequestException as e:
+        print(f"Error adding {dir_path} to IPFS Cluster: {e}")
+        return None
+    if response.status_code != 200:
+        print("Failed to add directory to IPFS Cluster.")
+        print(response.text)
+        return None
+
+    added = {entry.get('name', ''): _entry_cid(entry) for entry in _added_entries(response)}
+    # The wrapping directory is the entry without a name
+    root = added.get('', _entry_cid(_added_entries(response)[-1]))
+    files = [{'path': relative_path, 'cid': added.get(relative_path, ''), 'size': size}
+             for relative_path, _, size in entries if size is not None]
+    print(f"Directory added successfully with CID: {root}")
+    return root, files
+
+
+def pin_file(cid, replication_min=None, replication_max=None):
     """
     Pins a file in the IPFS Cluster to ensure it remains available.
+    Pinning an already pinned CID again updates its replication factors.
 
     :param cid: The CID of the file to be pinned.
     :param replication_min: The minimum number of replicas.
     :param replication_max: The maximum number of replicas.
+    :return: True if the file is pinned, otherwise False.
     """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
     url = f"{ipfs_cluster_api_url}pins/{cid}"
-    payload = {
-        "replication-min": replication_min,
-        "replication-max": replication_max
-    }
-    response = requests.post(url, json=payload)
+    # The cluster API takes pin options as query parameters
+    params = _replication_params(replication_min, replication_max)
+    try:
+        response = _request("POST", 'pin', url, params=params)
+    except requests.exceptions.RequestException as e:
+        print(f"Error connecting to IPFS Cluster API: {e}")
+        return False
 
     if response.status_code == 200:
         print(f"File with CID {cid} pinned successfully.")
+        return True
     else:
         print("Failed to pin file to IPFS Cluster.")
         print(response.text)
+        return False
 
 
 def get_file_status(cid):
@@ -74,7 +353,7 @@ def get_file_status(cid):
         read_config_file()
 
     url = f"{ipfs_cluster_api_url}pins/{cid}"
-    response = requests.get(url)
+    response = _request("GET", 'status', url)
 
     if response.status_code == 200:
         file_info = response.json()
@@ -84,77 +363,605 @@ def get_file_status(cid):
         print(response.text)
 
 
-def download_file_from_ipfs(cid, save_path):
+def _run_many(fn, items):
+    """
+    Calls fn(*item) for every item with up to bulk_workers calls in flight.
+
+    :return: {item[0]: result}, a call that raised maps to None
+    """
+    items = list(items)
+    if not items:
+        return {}
+
+    def call(item):
+        try:
+            return fn(*item)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error connecting to IPFS Cluster API: {e}")
+
+    with ThreadPoolExecutor(max_workers=min(bulk_workers, len(items))) as pool:
+        return dict(zip((item[0] for item in items), pool.map(call, items)))
+
+
+def pin_many(cids, replication_min=None, replication_max=None):
+    """
+    Pins several CIDs concurrently, see pin_file() and bulk_workers.
+
+    :return: {cid: True if pinned}
+    """
+    return {cid: bool(result) for cid, result in
+            _run_many(pin_file, [(cid, replication_min, replication_max) for cid in cids]).items()}
+
+
+def unpin_many(cids):
+    """
+    Removes several CIDs concurrently, see remove_file_from_cluster() and bulk_workers.
+    The garbage collection for all of them is batched by the GC scheduler.
+
+    :param cids: CIDs, or a dict of CID to file size in bytes.
+    :return: {cid: True if removed}
+    """
+    sizes = cids if isinstance(cids, dict) else dict.fromkeys(cids, 0)
+    return {cid: bool(result) for cid, result in _run_many(remove_file_from_cluster, sizes.items()).items()}
+
+
+def status_many(cids):
+    """
+    Fetches the status of several CIDs concurrently, see get_file_status() and bulk_workers.
+
+    :return: {cid: status dict, or None if it could not be fetched}
+    """
+    return _run_many(get_file_status, [(cid,) for cid in cids])
+
+
+def is_pinned(cid):
+    """
+    Checks whether the cluster already stores a CID, i.e. at least one peer reports it as pinned.
+
+    :param cid: The CID of the file.
+    :return: True if pinned, False if not or if the cluster could not be asked.
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
-    # Print the configuration to verify
-    print(f"IPFS Cluster API URL: {ipfs_cluster_api_url}")
-    print(f"IPFS Gateway URL: {ipfs_gateway_url}")
+    url = f"{ipfs_cluster_api_url}pins/{cid}"
+    try:
+        response = _request("GET", 'status', url)
+        if response.status_code != 200:
+            return False
+        peer_map = response.json().get('peer_map', {})
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error connecting to IPFS Cluster API: {e}")
+        return False
+    return any(info.get('status') == 'pinned' for info in peer_map.values())
+
+
+def record_gateway_latency(gateway, seconds):
+    """
+    Folds one time-to-first-byte sample into the gateway's EWMA.
+    """
+    with _gateway_latency_lock:
+        previous = gateway_latency.get(gateway)
+        gateway_latency[gateway] = seconds if previous is None else (
+            gateway_ewma_alpha * seconds + (1 - gateway_ewma_alpha) * previous)
 
-    url = f"{ipfs_gateway_url}ipfs/{cid}"
-    print(f"Download URL: {url}")
 
+def _record_gateway_failure(gateway):
+    # Push a failing gateway to the back of the ranking until it answers quickly again
+    with _gateway_latency_lock:
+        penalty = max(gateway_latency.values(), default=hedge_delay) * 4 + timeouts['gateway'][0]
+    record_gateway_latency(gateway, penalty)
+
+
+def _gateway_for_peer(peer_info):
+    """
+    Builds the gateway URL of a cluster peer from the first routable IPv4 address of its IPFS daemon,
+    using the port of the configured gateway.
+    """
+    port = urlparse(ipfs_gateway_url).port or 8080
+    addresses = peer_info.get('ipfs', {}).get('addresses') or peer_info.get('addresses') or []
+    for address in addresses:
+        match = re.match(r'/ip4/([0-9.]+)/', address)
+        if match and not match.group(1).startswith('127.') and 'p2p-circuit' not in address:
+            return f"http://{match.group(1)}:{port}/"
+    return None
+
+
+def candidate_gateways(cid):
+    """
+    Returns gateway base URLs for a CID, fastest first by EWMA. Gateways of the peers that have the CID
+    pinned come first, the configured gateway is always included as a fallback.
+    """
+    if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
+        read_config_file()
+
+    gateways = []
     try:
-        response = requests.get(url, stream=True, timeout=10)
-        if response.status_code == 200:
-            with open(save_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            print(f"File downloaded successfully and saved to {save_path}")
-            return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+        pinned = _pinned_peers_of(cid)
+        if pinned:
+            for peer_info in get_peer_directory().peers():
+                gateway = _gateway_for_peer(peer_info) if peer_info.get('id') in pinned else None
+                if gateway and gateway not in gateways:
+                    gateways.append(gateway)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Could not look up the peers pinning {cid}: {e}")
+    if ipfs_gateway_url not in gateways:
+        gateways.append(ipfs_gateway_url)
+
+    with _gateway_latency_lock:
+        # Unknown gateways rank as if they answered within hedge_delay, so they get tried
+        return sorted(gateways, key=lambda gateway: gateway_latency.get(gateway, hedge_delay))
+
+
+def _pinned_peers_of(cid):
+    """
+    :return: The ids of the peers that have cid pinned, from the cache if looked up within pinned_peers_ttl
+    """
+    now = time.monotonic()
+    with _pinned_peers_lock:
+        entry = _pinned_peers.get(cid)
+        if entry is not None and now - entry[0] < pinned_peers_ttl:
+            _pinned_peers.move_to_end(cid)
+            return entry[1]
+
+    status = get_file_status(cid)
+    if status is None:
+        # Failed lookups are not cached, the next download asks again
+        return set()
+    pinned = {peer_id for peer_id, info in status.get('peer_map', {}).items() if info.get('status') == 'pinned'}
+    with _pinned_peers_lock:
+        _pinned_peers[cid] = (now, pinned)
+        _pinned_peers.move_to_end(cid)
+        while len(_pinned_peers) > pinned_peers_max_entries:
+            _pinned_peers.popitem(last=False)
+    return pinned
+
+
+def _forget_pinned_peers(cid):
+    with _pinned_peers_lock:
+        _pinned_peers.pop(cid, None)
+
+
+def _answered(response):
+    return response.ok or response.status_code == 416
+
+
+def _hedged_get(urls, headers):
+    """
+    Sends the request to urls[0], and to the next URL whenever hedge_delay passes or a request fails
+    without an answer. The first 2xx or 416 response wins and the others are closed; a 416 is the
+    gateway's answer for a range outside the file, such as any range of an empty file.
+
+    :return: (winning url, streaming response)
+    """
+    results = queue.Queue()
+
+    def attempt(url):
+        gateway = url.split('ipfs/')[0]
+        try:
+            response = _request("GET", 'gateway', url, stream=True, headers=headers)
+        except requests.exceptions.RequestException as e:
+            _record_gateway_failure(gateway)
+            results.put((url, None, e))
+            return
+        if _answered(response):
+            record_gateway_latency(gateway, response.elapsed.total_seconds())
         else:
-            error_message = f"Failed to download file. Status code: {response.status_code}. Response: {response.text}"
-            print(error_message)
-            return {"success": False, "message": error_message}
-    except requests.exceptions.RequestException as e:
+            _record_gateway_failure(gateway)
+        results.put((url, response, None))
+
+    launched, finished = 0, 0
+    last_error, last_response = None, None
+    while True:
+        if launched < len(urls) and launched - finished < 2:
+            threading.Thread(target=attempt, args=(urls[launched],), daemon=True).start()
+            launched += 1
+        try:
+            url, response, error = results.get(timeout=hedge_delay if launched < len(urls) else None)
+        except queue.Empty:
+            # Hedge: the outstanding request is slow, start the next one
+            continue
+        finished += 1
+        if response is not None and _answered(response):
+            break
+        if last_response is not None:
+            last_response.close()
+        last_error, last_response = error, response
+        if finished == launched and launched == len(urls):
+            if last_response is not None:
+                return urls[-1], last_response
+            raise last_error
+
+    def close_losers(outstanding):
+        for _ in range(outstanding):
+            _, loser, _ = results.get()
+            if loser is not None:
+                loser.close()
+
+    if launched > finished:
+        threading.Thread(target=close_losers, args=(launched - finished,), daemon=True).start()
+    if last_response is not None:
+        last_response.close()
+    return url, response
+
+
+def open_gateway_stream(cid, start=None, end=None):
+    """
+    Opens a streaming GET for a CID on the fastest gateway, see candidate_gateways().
+    With start, only bytes [start, end] are asked for. A gateway may still answer 200 with the whole file,
+    check the status code. The caller closes the response.
+
+    :param cid: The CID of the file.
+    :param start: First byte wanted.
+    :param end: Last byte wanted, inclusive, None for the end of the file.
+    :return: The streaming requests.Response, which may be an error response.
+             Raises requests.exceptions.RequestException if no gateway answered.
+    """
+    urls = [f"{gateway}ipfs/{cid}" for gateway in candidate_gateways(cid)]
+    headers = {}
+    if start is not None:
+        headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    _, response = _hedged_get(urls, headers)
+    return response
+
+
+def download_file_from_ipfs(cid, save_path, segment_size=None, workers=None):
+    """
+    Downloads a file from the IPFS gateways of the peers that have it pinned.
+    The first request is hedged across the fastest gateways (see candidate_gateways() and hedge_delay),
+    the gateway that answers first serves the rest of the download.
+    When the gateway supports Range requests, the file is split into segments fetched in parallel and
+    written in place into a preallocated file. Finished segments are recorded in save_path + ".segments",
+    so calling this again after an interruption only fetches the missing segments.
+    Gateways without Range support are read as a single stream.
+
+    :param cid: The CID of the file.
+    :param save_path: Where to write the file.
+    :param segment_size: Bytes per Range request, defaults to download_segment_size.
+    :param workers: Number of segments fetched at once, defaults to download_workers.
+    :return: {"success": bool, "message": str}
+    """
+    try:
+        urls = [f"{gateway}ipfs/{cid}" for gateway in candidate_gateways(cid)]
+        # Ask for the first byte: a 206 reveals the size and Range support, a 200 is already the whole file
+        url, response = _hedged_get(urls, {'Range': 'bytes=0-0'})
+        print(f"Download URL: {url}")
+        with response:
+            if response.status_code == 416 and response.headers.get('Content-Range') == 'bytes */0':
+                # Gateways refuse any range of an empty file
+                open(save_path, "wb").close()
+                print(f"File downloaded successfully and saved to {save_path}")
+                return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+            match = re.match(r'bytes 0-0/(\d+)', response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or not match:
+                return _save_stream(response, save_path)
+        # Segments go to the winner first and fail over to the other gateways
+        urls = [url] + [other for other in urls if other != url]
+        return _download_ranged(cid, urls, save_path, int(match.group(1)), segment_size or download_segment_size,
+                                workers or download_workers)
+    except (requests.exceptions.RequestException, OSError) as e:
         error_message = f"Error downloading file from IPFS: {e}"
         print(error_message)
         return {"success": False, "message": error_message}
 
 
-def list_pinned_files():
+def _save_stream(response, save_path):
+    if response.status_code in (206, 416):
+        # Range answer without a usable Content-Range, fetch the whole file instead
+        with _request("GET", 'gateway', response.url, stream=True) as full_response:
+            return _save_stream(full_response, save_path)
+    if response.status_code == 200:
+        with open(save_path, "wb") as file:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                file.write(chunk)
+        print(f"File downloaded successfully and saved to {save_path}")
+        return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+    else:
+        error_message = f"Failed to download file. Status code: {response.status_code}. Response: {response.text}"
+        print(error_message)
+        return {"success": False, "message": error_message}
+
+
+def _load_segment_state(state_path, cid, size, segment_size, save_path):
     """
-    Retrieves information about all pinned files in the IPFS Cluster.
+    :return: A bytearray with one entry per segment, 1 for segments already on disk
+    """
+    segments = -(-size // segment_size)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        if (state['cid'] == cid and state['size'] == size and state['segment_size'] == segment_size
+                and os.path.getsize(save_path) == size):
+            done = bytearray(bytes.fromhex(state['done']))
+            if len(done) == segments:
+                return done
+    except (OSError, ValueError, KeyError):
+        pass
+    # Start over with a preallocated file
+    with open(save_path, "wb") as f:
+        f.truncate(size)
+    return bytearray(segments)
 
-    :return: A list of information about pinned files if successful, otherwise None.
+
+def _save_segment_state(state_path, cid, size, segment_size, done):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'cid': cid, 'size': size, 'segment_size': segment_size, 'done': done.hex()}, f)
+    os.replace(tmp_path, state_path)
+
+
+def _fetch_segment(url, save_path, start, end):
+    """
+    Writes bytes [start, end] of url into the same range of save_path.
+    """
+    gateway = url.split('ipfs/')[0]
+    with _request("GET", 'gateway', url, stream=True, headers={'Range': f'bytes={start}-{end}'}) as response:
+        if response.status_code != 206:
+            raise requests.exceptions.RequestException(f"Range request answered with status {response.status_code}")
+        written = 0
+        with open(save_path, "r+b") as file:
+            file.seek(start)
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                file.write(chunk)
+                written += len(chunk)
+        record_gateway_latency(gateway, response.elapsed.total_seconds())
+    if written != end - start + 1:
+        raise requests.exceptions.RequestException(f"Segment {start}-{end} ended after {written} bytes")
+
+
+def _download_ranged(cid, urls, save_path, size, segment_size, workers):
+    state_path = save_path + ".segments"
+    done = _load_segment_state(state_path, cid, size, segment_size, save_path)
+    state_lock = threading.Lock()
+
+    def fetch(index):
+        start = index * segment_size
+        end = min(start + segment_size, size) - 1
+        for attempt in range(download_segment_attempts):
+            url = urls[attempt % len(urls)]
+            try:
+                _fetch_segment(url, save_path, start, end)
+                break
+            except requests.exceptions.RequestException as e:
+                _record_gateway_failure(url.split('ipfs/')[0])
+                if attempt == download_segment_attempts - 1:
+                    raise
+                print(f"Retrying segment {index} of {cid}: {e}")
+        with state_lock:
+            done[index] = 1
+            _save_segment_state(state_path, cid, size, segment_size, done)
+
+    missing = [i for i, finished in enumerate(done) if not finished]
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+        for future in [pool.submit(fetch, i) for i in missing]:
+            try:
+                future.result()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+
+    if errors:
+        error_message = (f"Failed to download {len(errors)} of {len(done)} segments of {cid}: {errors[0]}. "
+                         f"Call again to resume.")
+        print(error_message)
+        return {"success": False, "message": error_message}
+
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"File downloaded successfully and saved to {save_path}")
+    return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+
+
+def _iter_json_values(response, chunk_size=64 * 1024):
+    """
+    Yields the JSON values of a streamed response one at a time, without holding the whole body.
+    Accepts newline-delimited JSON as well as a top-level JSON array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer += text_decoder.decode(chunk)
+        position = 0
+        while True:
+            # Skip whitespace and the punctuation of a surrounding array
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Incomplete value, wait for the next chunk
+                break
+            yield value
+        buffer = buffer[position:]
+    buffer = (buffer + text_decoder.decode(b'', final=True)).strip(' \t\r\n,[]')
+    if buffer:
+        raise ValueError(f"Truncated JSON stream: {buffer[:80]!r}")
+
+
+def iter_pinned_files(status=None, cids=None, peer=None):
+    """
+    Iterates over the pinned files of the IPFS Cluster while the response is still being received.
+    Status and CID filters are applied by the cluster. The cluster API cannot filter by peer, entries
+    whose peer_map does not contain peer (in one of the requested statuses) are skipped here.
+
+    :param status: Tracker status or list of them, such as 'pinned' or ['pinning', 'pin_error'].
+    :param cids: Only these CIDs.
+    :param peer: Only pins this peer ID tracks.
+    :return: A generator of pin entries, see client.get_all_pinned_file() for the format.
+             Raises requests.exceptions.RequestException if the cluster cannot be reached
+             and ValueError if the response is cut short.
     """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
 
+    statuses = [status] if isinstance(status, str) else list(status or [])
+    params = {}
+    if statuses:
+        params['filter'] = ','.join(statuses)
+    if cids:
+        params['cids'] = ','.join(cids)
+    if peer is not None and peer == _local_peer_id():
+        # The local view is enough and much cheaper for the cluster
+        params['local'] = 'true'
+
     url = f"{ipfs_cluster_api_url}pins"
+    with _request("GET", 'pins', url, params=params, stream=True) as response:
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(
+                f"Failed to retrieve pinned files. Status code: {response.status_code}. Response: {response.text}",
+                response=response)
+        for entry in _iter_json_values(response):
+            if peer is not None:
+                peer_status = entry.get('peer_map', {}).get(peer)
+                if peer_status is None or (statuses and peer_status.get('status') not in statuses):
+                    continue
+            yield entry
+
+
+def _local_peer_id():
+    # Looked up once, the peer behind the API URL does not change while the process runs
+    global _my_peer_id
+    if _my_peer_id is None:
+        _my_peer_id = get_my_peer_id()
+    return _my_peer_id
+
+
+def list_pinned_files(status=None, cids=None, peer=None):
+    """
+    Retrieves information about all pinned files in the IPFS Cluster.
+    Takes the same filters as iter_pinned_files().
+
+    :return: A list of information about pinned files if successful, otherwise None.
+    """
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            pinned_files = response.json()
-            return pinned_files
-        else:
-            print(f"Failed to retrieve pinned files. Status code: {response.status_code}")
-            print(response.text)
-    except requests.exceptions.RequestException as e:
+        return list(iter_pinned_files(status, cids, peer))
+    except requests.exceptions.HTTPError as e:
+        print(e)
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error connecting to IPFS Cluster API: {e}")
 
 
+class PeerDirectory:
+    """
+    The /peers list of the cluster, indexed by peer id and by peername.
+    A background thread refreshes it every interval seconds, lookups never wait for the cluster API
+    except for the very first one. A lookup of an unknown peer id triggers an early refresh, at most
+    once per second, so peers that just joined are found without waiting for the next interval.
+    Until a refresh has succeeded, every lookup retries the cluster, also at most once per second.
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or peer_refresh_interval
+        self._peers = []
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshed_at = None
+        self._loaded = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="peer-directory", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Reloads /peers. On failure the previous list is kept.
+
+        :return: True if the directory was updated
+        """
+        if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
+            read_config_file()
+
+        with self._refresh_lock:
+            url = f"{ipfs_cluster_api_url}/peers"
+            try:
+                response = _request("GET", 'peers', url)
+                if response.status_code != 200:
+                    print(f"Failed to retrieve peers info. Status code: {response.status_code}")
+                    print(response.text)
+                    return False
+                peers = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"Error connecting to IPFS Cluster API: {e}")
+                return False
+            finally:
+                self._refreshed_at = time.monotonic()
+
+            by_id = {peer.get('id'): peer for peer in peers}
+            by_name = {peer.get('peername'): peer for peer in peers if peer.get('peername')}
+            with self._lock:
+                self._peers, self._by_id, self._by_name = peers, by_id, by_name
+            self._loaded = True
+            return True
+
+    def _ensure_loaded(self):
+        if self._refreshed_at is None or (not self._loaded and time.monotonic() - self._refreshed_at >= 1.0):
+            self.refresh()
+
+    def peers(self) -> list:
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._peers)
+
+    def get(self, peer_id: str):
+        """
+        :return: The /peers entry of peer_id, or None
+        """
+        self._ensure_loaded()
+        with self._lock:
+            peer = self._by_id.get(peer_id)
+        if peer is None and time.monotonic() - self._refreshed_at >= 1.0 and self.refresh():
+            with self._lock:
+                peer = self._by_id.get(peer_id)
+        return peer
+
+    def find_by_name(self, peername: str):
+        """
+        :return: The /peers entry of the peer called peername, or None
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return self._by_name.get(peername)
+
+
+def get_peer_directory() -> PeerDirectory:
+    """
+    Returns the process-wide PeerDirectory, its background refresh starts on first use.
+    """
+    global _peer_directory
+    if _peer_directory is None:
+        with _session_lock:
+            if _peer_directory is None:
+                directory = PeerDirectory()
+                directory.start()
+                _peer_directory = directory
+    return _peer_directory
+
+
 def list_all_peers():
     """
     Retrieves information about all peers in the IPFS Cluster.
+    Served from the peer directory, see PeerDirectory.
 
     :return: A list of information about all peers if successful, otherwise None.
     """
-    if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
-        read_config_file()
-
-    url = f"{ipfs_cluster_api_url}/peers"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            peers_info = response.json()
-            return peers_info[0]
-        else:
-            print(f"Failed to retrieve peers info. Status code: {response.status_code}")
-            print(response.text)
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to IPFS Cluster API: {e}")
+    peers_info = get_peer_directory().peers()
+    if peers_info:
+        return peers_info[0]
 
 
 def get_my_peer_id():
@@ -168,7 +975,7 @@ def get_my_peer_id():
 
     url = f"{ipfs_cluster_api_url}/id"
     try:
-        response = requests.get(url)
+        response = _request("GET", 'id', url)
         if response.status_code == 200:
             peer_info = response.json()
             peer_id = peer_info.get('id')
@@ -184,31 +991,26 @@ def get_my_peer_id():
 def get_peer_name(peer_id):
     """
     Fetch the peer name of a specific peer by its ID.
+    Served from the peer directory, see PeerDirectory.
 
-    :param api_url: The base URL of the IPFS Cluster API.
     :param peer_id: The peer ID of the target node.
     :return: The peer name if found, otherwise None.
     """
-    url = f"{ipfs_cluster_api_url}/peers"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            peers = response.json()
-            for peer in peers:
-                if peer["id"] == peer_id:
-                    return peer.get("peername", "Unknown Peername")
-            print(f"Peer ID {peer_id} not found in the cluster.")
-        else:
-            print(f"Failed to fetch peers. Status code: {response.status_code}")
-            print(response.text)
-    except Exception as e:
-        print(f"Error fetching peername: {e}")
-    return None
-def remove_file_from_cluster(cid):
+    peer = get_peer_directory().get(peer_id)
+    if peer is None:
+        print(f"Peer ID {peer_id} not found in the cluster.")
+        return None
+    return peer.get("peername", "Unknown Peername")
+
+
+def remove_file_from_cluster(cid, size=0):
     """
     Removes a file from the IPFS Cluster.
+    The unpin happens right away, the cluster-wide garbage collection that frees the blocks is
+    batched with other removals, see GCScheduler.
 
     :param cid: The CID of the file to be removed.
+    :param size: Size of the file in bytes, counts towards gc_freed_bytes_threshold.
     :return: True if the file is successfully removed, otherwise False.
     """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
@@ -219,7 +1021,7 @@ def remove_file_from_cluster(cid):
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
-    verify_response = requests.get(verify_url, headers=headers)
+    verify_response = _request("GET", 'status', verify_url, headers=headers)
     
     if verify_response.status_code == 404:
         print(f"CID {cid} not found in cluster")
@@ -228,11 +1030,12 @@ def remove_file_from_cluster(cid):
     url = f"{ipfs_cluster_api_url}pins/{cid}"
     try:
         
-        response = requests.delete(url, headers=headers)
+        response = _request("DELETE", 'unpin', url, headers=headers)
         if response.status_code == 200:
             print(f"File with CID {cid} successfully removed from IPFS Cluster.")
-            trigger_gc_on_nodes()
-            print(f"File with CID {cid} successfully deleted from IPFS Cluster.")
+            _forget_pinned_peers(cid)
+            get_gc_scheduler().record(cid, size)
+            print(f"File with CID {cid} queued for garbage collection.")
             return True
         else:
             print(f"Failed to remove file with CID {cid}. Status code: {response.status_code}")
@@ -243,16 +1046,139 @@ def remove_file_from_cluster(cid):
         return False
     
 def trigger_gc_on_nodes():
+    """
+    Runs garbage collection on every IPFS node of the cluster.
+
+    :return: True if the GC succeeded, otherwise False.
+    """
     if ipfs_cluster_api_url is None or ipfs_gateway_url is None:
         read_config_file()
     
     gc_url = f"{ipfs_cluster_api_url}ipfs/gc?local=false"
     try:
-        response = requests.post(gc_url)
+        response = _request("POST", 'gc', gc_url)
         if response.status_code == 200:
             print("Garbage collection successfully triggered.")
+            return True
         else:
             print(f"Failed to trigger GC. Status code: {response.status_code}")
             print(response.text)
     except requests.exceptions.RequestException as e:
         print(f"Error triggering garbage collection: {e}")
+    return False
+
+
+class GCScheduler:
+    """
+    Collects unpinned CIDs and runs one cluster-wide GC for all of them, instead of one GC per unpin.
+    A background thread starts the GC once no unpin arrived for debounce seconds, once the pending
+    unpins add up to threshold bytes, or max_delay seconds after the oldest pending unpin.
+    If the GC fails, the unpins stay pending and are retried with the next run.
+    """
+
+    def __init__(self, debounce: float = None, threshold: int = None, max_delay: float = None):
+        self.debounce = gc_debounce if debounce is None else debounce
+        self.threshold = gc_freed_bytes_threshold if threshold is None else threshold
+        self.max_delay = gc_max_delay if max_delay is None else max_delay
+        self._pending = {}
+        self._pending_bytes = 0
+        self._first_at = None
+        self._last_at = None
+        self._condition = threading.Condition()
+        self._gc_lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self._thread = threading.Thread(target=self._run, name="gc-scheduler", daemon=True)
+        self._thread.start()
+
+    def record(self, cid: str, size: int = 0):
+        """
+        Queues the blocks of an unpinned CID for the next GC
+        """
+        with self._condition:
+            now = time.monotonic()
+            if cid not in self._pending:
+                self._pending[cid] = size or 0
+                self._pending_bytes += size or 0
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+            self._condition.notify()
+
+    def _due_in(self):
+        # Seconds until the next GC is due, None while nothing is pending
+        if not self._pending:
+            return None
+        if self._pending_bytes >= self.threshold:
+            return 0.0
+        now = time.monotonic()
+        return max(0.0, min(self._last_at + self.debounce, self._first_at + self.max_delay) - now)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due_in = self._due_in()
+                while due_in is None or due_in > 0:
+                    self._condition.wait(due_in)
+                    due_in = self._due_in()
+            self.flush()
+            if self.last_run and not self.last_run['success']:
+                # Do not retry a failing GC in a tight loop
+                time.sleep(self.debounce)
+
+    def flush(self) -> bool:
+        """
+        Runs the GC now for everything pending.
+
+        :return: True if nothing was pending or the GC succeeded
+        """
+        with self._gc_lock:
+            with self._condition:
+                batch, freed = self._pending, self._pending_bytes
+                self._pending, self._pending_bytes = {}, 0
+                self._first_at = self._last_at = None
+            if not batch:
+                return True
+
+            success = trigger_gc_on_nodes()
+            self.runs += 1
+            self.last_run = {'time': time.time(), 'cids': len(batch), 'bytes': freed, 'success': success}
+            if not success:
+                self.failures += 1
+                with self._condition:
+                    for cid, size in batch.items():
+                        if cid not in self._pending:
+                            self._pending[cid] = size
+                            self._pending_bytes += size
+                    now = time.monotonic()
+                    self._first_at = min(self._first_at or now, now)
+                    self._last_at = self._last_at or now
+            return success
+
+    def state(self) -> dict:
+        with self._condition:
+            due_in = self._due_in()
+            return {
+                'pending_cids': len(self._pending),
+                'pending_bytes': self._pending_bytes,
+                'next_gc_in': due_in,
+                'debounce': self.debounce,
+                'threshold': self.threshold,
+                'max_delay': self.max_delay,
+                'runs': self.runs,
+                'failures': self.failures,
+                'last_run': self.last_run,
+            }
+
+
+def get_gc_scheduler() -> GCScheduler:
+    """
+    Returns the process-wide GCScheduler, created on first use.
+    """
+    global _gc_scheduler
+    if _gc_scheduler is None:
+        with _session_lock:
+            if _gc_scheduler is None:
+                _gc_scheduler = GCScheduler()
+    return _gc_scheduler
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+import ipfs_cluster
+
+# Open connections kept per client, across all hosts
+max_connections = 32
+
+# Cluster and gateway calls a client runs at the same time, further calls wait for a free slot
+max_concurrency = 16
+
+
+def _json_values(text: str) -> list:
+    # The cluster answers with newline-delimited JSON or a JSON array, see ipfs_cluster._added_entries()
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class AsyncClusterClient:
+    """
+    The asyncio counterpart of ipfs_cluster.py, for code that fans out many cluster calls at once.
+    All calls share one aiohttp connection pool, and at most concurrency of them are in flight.
+    URLs, timeouts and /add settings come from ipfs_cluster. Results follow ipfs_cluster as well:
+    None or False on failure, with the reason printed.
+
+        async with AsyncClusterClient() as cluster:
+            statuses = await asyncio.gather(*(cluster.status(cid) for cid in cids))
+
+    :param api_url: IPFS Cluster API URL, defaults to config/ipfs.config
+    :param gateway_url: IPFS gateway URL, defaults to config/ipfs.config
+    :param concurrency: Calls in flight at once, defaults to max_concurrency
+    :param connections: Size of the connection pool, defaults to max_connections
+    """
+
+    def __init__(self, api_url: str = None, gateway_url: str = None, concurrency: int = None,
+                 connections: int = None):
+        if (api_url is None or gateway_url is None) and ipfs_cluster.ipfs_cluster_api_url is None:
+            ipfs_cluster.read_config_file()
+        self.api_url = api_url or ipfs_cluster.ipfs_cluster_api_url
+        self.gateway_url = gateway_url or ipfs_cluster.ipfs_gateway_url
+        self.concurrency = concurrency or max_concurrency
+        self.connections = connections or max_connections
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created on first use, so the client can be built outside a running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    def _request(self, method: str, endpoint: str, url: str, **kwargs):
+        connect, read = ipfs_cluster.timeouts[endpoint]
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        return self._get_session().request(method, url, timeout=timeout, **kwargs)
+
+    async def add_file(self, file_path: str):
+        """
+        Adds a file to the IPFS Cluster, streamed from disk.
+
+        :return: The CID of the file if successful, otherwise None.
+        """
+        form = aiohttp.FormData()
+        try:
+            async with self._slot():
+                with open(file_path, 'rb') as f:
+                    form.add_field('file', f, filename=os.path.basename(file_path),
+                                   content_type='application/octet-stream')
+                    async with self._request("POST", 'add', f"{self.api_url}add", data=form,
+                                             params=ipfs_cluster.add_params) as response:
+                        text = await response.text()
+                        if response.status != 200:
+                            print("Failed to add file to IPFS Cluster.")
+                            print(text)
+                            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            print(f"Error adding {file_path} to IPFS Cluster: {e}")
+            return None
+        cid = ipfs_cluster._entry_cid(_json_values(text)[-1])
+        print(f"File added successfully with CID: {cid}")
+        return cid
+
+    async def pin(self, cid: str, replication_min: int = None, replication_max: int = None) -> bool:
+        """
+        Pins a CID, optionally with its own replication factors.
+        """
+        params = ipfs_cluster._replication_params(replication_min, replication_max)
+        status, text = await self._call("POST", 'pin', f"{self.api_url}pins/{cid}", params=params)
+        if status == 200:
+            return True
+        print(f"Failed to pin {cid}. Status code: {status}. Response: {text}")
+        return False
+
+    async def status(self, cid: str):
+        """
+        :return: The status of a CID on every peer, see ipfs_cluster.get_file_status(), or None.
+        """
+        status, text = await self._call("GET", 'status', f"{self.api_url}pins/{cid}")
+        if status == 200:
+            return json.loads(text)
+        print(f"Failed to get the status of {cid}. Status code: {status}. Response: {text}")
+
+    async def unpin(self, cid: str, size: int = 0) -> bool:
+        """
+        Unpins a CID. Its blocks are freed by the next scheduled GC, see ipfs_cluster.GCScheduler.
+        """
+        status, text = await self._call("DELETE", 'unpin', f"{self.api_url}pins/{cid}")
+        if status == 200:
+            ipfs_cluster._forget_pinned_peers(cid)
+            ipfs_cluster.get_gc_scheduler().record(cid, size)
+            return True
+        print(f"Failed to unpin {cid}. Status code: {status}. Response: {text}")
+        return False
+
+    async def peers(self):
+        """
+        :return: The /peers list, or None.
+        """
+        status, text = await self._call("GET", 'peers', f"{self.api_url}peers")
+        if status == 200:
+            return _json_values(text)
+        print(f"Failed to retrieve peers info. Status code: {status}. Response: {text}")
+
+    async def id(self):
+        """
+        :return: The peer ID of the cluster peer behind api_url, or None.
+        """
+        status, text = await self._call("GET", 'id', f"{self.api_url}id")
+        if status == 200:
+            return json.loads(text).get('id')
+        print(f"Failed to retrieve peer ID. Status code: {status}. Response: {text}")
+
+    async def download(self, cid: str, save_path: str) -> dict:
+        """
+        Downloads a CID from the gateway into save_path.
+
+        :return: {"success": bool, "message": str}
+        """
+        url = f"{self.gateway_url}ipfs/{cid}"
+        try:
+            async with self._slot():
+                async with self._request("GET", 'gateway', url) as response:
+                    if response.status != 200:
+                        error_message = f"Failed to download file. Status code: {response.status}. Response: {await response.text()}"
+                        print(error_message)
+                        return {"success": False, "message": error_message}
+                    with open(save_path, "wb") as file:
+                        async for chunk in response.content.iter_chunked(ipfs_cluster.upload_chunk_size):
+                            await asyncio.to_thread(file.write, chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            error_message = f"Error downloading file from IPFS: {e}"
+            print(error_message)
+            return {"success": False, "message": error_message}
+        return {"success": True, "message": f"File downloaded successfully and saved to {save_path}"}
+
+    def _slot(self) -> asyncio.Semaphore:
+        self._get_session()
+        return self._semaphore
+
+    async def _call(self, method: str, endpoint: str, url: str, **kwargs):
+        """
+        :return: (HTTP status, body), or (None, error message) if the cluster could not be reached
+        """
+        try:
+            async with self._slot():
+                async with self._request(method, endpoint, url, **kwargs) as response:
+                    return response.status, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return None, str(e)
@@ -1,18 +1,881 @@
+import abc
+import asyncio
+import copy
+import functools
+import json
 import os
+import random
+import sqlite3
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath("bazel/bazel-bin/kv_service/"))
-import pybind_kv
+try:
+    import pybind_kv
+except ImportError:
+    # Only the ResilientDB backend needs the native module
+    pybind_kv = None
 os.path.abspath("config/kv_server.config")
 config_path = "config/kv_server.config"
 
-def set_kv(key: str, value: str):
-    global config_path
+# Which backend get_session() creates: "resdb", "memory" or "sqlite", see create_backend()
+backend_name = os.environ.get("RESSHARE_KV_BACKEND", "resdb")
+
+# Number of KVClient connections kept open by the shared session
+session_pool_size = 4
+
+# Read cache settings, see configure_cache()
+cache_max_entries = 4096
+cache_ttl = 10.0
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+# The active WriteBehindQueue, see enable_write_behind()
+write_behind = None
+
+
+class KVBackend(abc.ABC):
+    """
+    The interface kv_service uses to reach a key-value store.
+    Missing keys read as "", set/set_many report success per key.
+    Subclasses implement get and set, get_many and set_many may be overridden with batched versions.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> str:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str) -> bool:
+        pass
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items: list) -> list:
+        return [self.set(key, value) for key, value in items]
+
+
+class KVSession(KVBackend):
+    """
+    A long-lived connection to the ResilientDB KV service.
+    The config file is parsed once and the native clients are reused for every call,
+    so a get/set only pays for the request itself. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = None, pool_size: int = None):
+        if pybind_kv is None:
+            raise ImportError("pybind_kv is not built, run `bazel build //...` in bazel/ or use another KV backend")
+        self.config_path = path or config_path
+        self.pool_size = pool_size or session_pool_size
+        self._native = pybind_kv.KVSession(self.config_path, self.pool_size)
+
+    def get(self, key: str) -> str:
+        return self._native.get(key)
+
+    def set(self, key: str, value: str) -> bool:
+        return self._native.set(key, value)
+
+    def get_many(self, keys: list) -> list:
+        return self._native.get_many(keys)
+
+    def set_many(self, items: list) -> list:
+        return self._native.set_many(items)
+
+
+class _SimulatedLatency:
+    """
+    Sleeps like a remote store would. A batch of n keys costs ceil(n / parallelism) round trips,
+    the same way KVSession spreads a batch over its client pool.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, parallelism: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.parallelism = parallelism or session_pool_size
+
+    def _round_trips(self, keys: int = 1):
+        if self.latency <= 0 and self.jitter <= 0:
+            return
+        trips = -(-keys // self.parallelism)
+        time.sleep(max(0.0, trips * self.latency + random.uniform(-self.jitter, self.jitter)))
+
+
+class MemoryBackend(KVBackend, _SimulatedLatency):
+    """
+    A dict in this process, for load testing client.py without a ResilientDB deployment
+
+    :param latency: Seconds added to every round trip
+    :param jitter: Up to this many seconds are randomly added or removed per call
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, parallelism: int = None):
+        _SimulatedLatency.__init__(self, latency, jitter, parallelism)
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str:
+        self._round_trips()
+        with self._lock:
+            return self._data.get(key, "")
+
+    def set(self, key: str, value: str) -> bool:
+        self._round_trips()
+        with self._lock:
+            self._data[key] = value
+        return True
+
+    def get_many(self, keys: list) -> list:
+        self._round_trips(len(keys))
+        with self._lock:
+            return [self._data.get(key, "") for key in keys]
+
+    def set_many(self, items: list) -> list:
+        self._round_trips(len(items))
+        with self._lock:
+            self._data.update(items)
+        return [True] * len(items)
+
+
+class SQLiteBackend(KVBackend, _SimulatedLatency):
+    """
+    A single SQLite file, for load tests that need more data than fits in memory or
+    that should survive a restart
+
+    :param path: The database file, created if missing
+    """
+
+    def __init__(self, path: str = "kv_store.sqlite3", latency: float = 0.0, jitter: float = 0.0, parallelism: int = None):
+        _SimulatedLatency.__init__(self, latency, jitter, parallelism)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key: str) -> str:
+        return self.get_many([key])[0]
+
+    def set(self, key: str, value: str) -> bool:
+        return self.set_many([(key, value)])[0]
+
+    def get_many(self, keys: list) -> list:
+        self._round_trips(len(keys))
+        found = {}
+        with self._lock:
+            # Stay below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._conn.execute(f"SELECT key, value FROM kv WHERE key IN ({placeholders})", chunk))
+        return [found.get(key, "") for key in keys]
+
+    def set_many(self, items: list) -> list:
+        self._round_trips(len(items))
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", items)
+        return [True] * len(items)
+
+
+def create_backend(name: str = None, **options) -> KVBackend:
+    """
+    Build a KV backend by name. Without options, the stand-ins read their settings from
+    RESSHARE_KV_LATENCY_MS, RESSHARE_KV_JITTER_MS and RESSHARE_KV_SQLITE_PATH.
+
+    :param name: "resdb" (default), "memory" or "sqlite"
+    :param options: Passed to the backend constructor
+    """
+    name = name or backend_name
+    if name == "resdb":
+        return KVSession(**options)
+    if name not in ("memory", "sqlite"):
+        raise ValueError(f"Unknown KV backend {name!r}")
+
+    options.setdefault('latency', float(os.environ.get("RESSHARE_KV_LATENCY_MS", 0)) / 1000)
+    options.setdefault('jitter', float(os.environ.get("RESSHARE_KV_JITTER_MS", 0)) / 1000)
+    if name == "memory":
+        return MemoryBackend(**options)
+    options.setdefault('path', os.environ.get("RESSHARE_KV_SQLITE_PATH", "kv_store.sqlite3"))
+    return SQLiteBackend(**options)
+
+
+def use_backend(backend: KVBackend):
+    """
+    Replace the backend every kv_service call goes through. The read cache is cleared.
+    """
+    global _session
+    with _session_lock:
+        _session = backend
+    cache.invalidate()
+
+
+class KVCache:
+    """
+    A bounded LRU cache of KV values with a time-to-live.
+    Writes from this process are applied to the cache directly, values written by other
+    processes become visible once the cached entry expires, so staleness is bounded by ttl.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 10.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        :return: The cached value, or None if the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str = None):
+        """
+        Drop one key, or every key when called without arguments
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+cache = KVCache(cache_max_entries, cache_ttl)
+
+
+def configure_cache(max_entries: int = None, ttl: float = None):
+    """
+    Change the read cache settings. max_entries=0 disables caching.
+    Existing entries are dropped so the new TTL applies to everything.
+    """
+    if max_entries is not None:
+        cache.max_entries = max_entries
+    if ttl is not None:
+        cache.ttl = ttl
+    cache.invalidate()
+
+
+def cache_stats() -> dict:
+    return cache.stats()
+
+
+def get_session() -> KVBackend:
+    """
+    Return the process-wide backend, creating it on first use from backend_name
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_backend()
+    return _session
+
+
+def set_kv(key: str, value: str) -> bool:
+    """
+    :return: True if the write was accepted
+    """
     print(f"SETTING {key}, {value}")
-    pybind_kv.set(key, value, config_path)
+    if write_behind is not None:
+        write_behind.put_many({key: value})
+        cache.put(key, value)
+    elif get_session().set(key, value):
+        cache.put(key, value)
+    else:
+        cache.invalidate(key)
+        return False
+    return True
 
 
-def get_kv(key: str) -> str:
-    global config_path
+def get_kv(key: str, fresh: bool = False) -> str:
+    """
+    :param fresh: Skip the cache and read from ResilientDB, e.g. before a read-modify-write.
+                  Writes still waiting in the write-behind queue are always returned.
+    """
+    if write_behind is not None:
+        value = write_behind.get(key)
+        if value is not None:
+            return value
+    if not fresh:
+        value = cache.get(key)
+        if value is not None:
+            return value
     print(f"GETTING {key}")
-    return pybind_kv.get(key, config_path)
+    value = get_session().get(key)
+    cache.put(key, value)
+    return value
+
+
+def get_many(keys, fresh: bool = False) -> dict:
+    """
+    Fetch several keys in one batched call.
+    The requests are spread over the session's client pool, so the latency grows with
+    len(keys) / pool_size instead of len(keys). Cached keys are not fetched again.
+
+    :param keys: An iterable of keys, duplicates are fetched once
+    :param fresh: Skip the cache and read every key from ResilientDB
+    :return: A python dict {key: value}, missing keys map to ""
+    """
+    keys = list(dict.fromkeys(keys))
+    result = {}
+    missing = []
+    for key in keys:
+        value = None if write_behind is None else write_behind.get(key)
+        if value is None and not fresh:
+            value = cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            result[key] = value
+    if missing:
+        print(f"GETTING {len(missing)} keys")
+        for key, value in zip(missing, get_session().get_many(missing)):
+            cache.put(key, value)
+            result[key] = value
+    return {key: result[key] for key in keys}
+
+
+def set_many(mapping: dict) -> bool:
+    """
+    Write several key/value pairs in one batched call.
+
+    :param mapping: A python dict {key: value}
+    :return: True if every write succeeded, otherwise False
+    """
+    if not mapping:
+        return True
+    print(f"SETTING {len(mapping)} keys")
+    if write_behind is not None:
+        write_behind.put_many(mapping)
+        for key, value in mapping.items():
+            cache.put(key, value)
+        return True
+    items = list(mapping.items())
+    results = get_session().set_many(items)
+    for (key, value), ok in zip(items, results):
+        if ok:
+            cache.put(key, value)
+        else:
+            cache.invalidate(key)
+    return all(results)
+
+
+# Returned by an update() mutation that leaves the value as it is
+UNCHANGED = object()
+
+_key_mutations = {}
+_key_mutations_lock = threading.Lock()
+
+
+class _Mutation:
+    def __init__(self, mutate):
+        self.mutate = mutate
+        self.done = threading.Event()
+        # Set when this caller has to apply the next batch for the key
+        self.batch = None
+        self.result = None
+        self.error = None
+
+
+def update(key: str, mutate, kind: str = None, default=None):
+    """
+    Read-modify-write one key without losing concurrent updates made through this function.
+    Mutations of the same key are queued: one caller reads the value once, applies every queued
+    mutation in order and writes the result once, then hands over to the next batch. N parallel
+    callers therefore cost about one read and one write per batch instead of racing each other.
+    The guarantee covers this process only, other processes are not coordinated.
+
+    :param key: The key to update
+    :param mutate: A function taking the current value and returning the new one, or UNCHANGED.
+                   If it raises, the error is re-raised to its caller and the other mutations still apply.
+    :param kind: Decode/encode the value with this codec kind, see encode_value(). None passes the raw string.
+    :param default: Used when the key is missing or unreadable (copied per batch)
+    :return: The value after the batch containing this mutation was written
+    """
+    op = _Mutation(mutate)
+    with _key_mutations_lock:
+        waiting = _key_mutations.get(key)
+        if waiting is None:
+            # Nothing in flight for this key, apply right away
+            _key_mutations[key] = []
+            op.batch = [op]
+        else:
+            waiting.append(op)
+
+    if op.batch is None:
+        op.done.wait()
+    if op.batch is not None:
+        try:
+            _apply_mutations(key, op.batch, kind, default)
+        finally:
+            # Whoever queued up meanwhile forms the next batch, led by its first caller
+            with _key_mutations_lock:
+                waiting = _key_mutations[key]
+                if waiting:
+                    _key_mutations[key] = []
+                    waiting[0].batch = waiting
+                    waiting[0].done.set()
+                else:
+                    del _key_mutations[key]
+
+    if op.error is not None:
+        raise op.error
+    return op.result
+
+
+def _apply_mutations(key, batch, kind, default):
+    try:
+        raw = get_kv(key, fresh=True)
+        value = raw if kind is None else decode_value(kind, raw)
+        if value is None or (kind is None and not raw and default is not None):
+            value = copy.deepcopy(default)
+    except Exception as e:
+        # Every caller of the batch sees the failed read, none of the mutations apply
+        for op in batch:
+            op.error = e
+            op.done.set()
+        return
+    changed = False
+    for op in batch:
+        try:
+            new_value = op.mutate(value)
+        except Exception as e:
+            op.error = e
+            continue
+        if new_value is not UNCHANGED:
+            value = new_value
+            changed = True
+
+    if changed:
+        try:
+            ok = set_kv(key, value if kind is None else encode_value(kind, value))
+            if not ok:
+                raise RuntimeError(f"Failed to write {key}")
+        except Exception as e:
+            for op in batch:
+                if op.error is None:
+                    op.error = e
+    for op in batch:
+        op.result = value
+        op.done.set()
+
+
+class WriteBehindQueue:
+    """
+    Group commit for KV writes.
+    Each write is appended to a local journal file and acknowledged; a background thread then
+    applies pending writes to the backend in batches with set_many(). Writes to the same key that
+    are still pending are coalesced, so only the latest value is sent. On start the journal is
+    replayed, so writes acknowledged before a crash are not lost.
+
+    :param journal_path: File used to persist pending writes
+    :param flush_interval: Seconds the writer waits to gather more writes into a batch
+    :param max_batch: Maximum number of keys per set_many() call
+    :param fsync: fsync the journal on every write; disable to trade durability for latency
+    """
+
+    # Rewrite the journal once it grows past this size while writes keep coming
+    compact_bytes = 16 * 1024 * 1024
+
+    def __init__(self, journal_path: str = "kv_journal.log", flush_interval: float = 0.05, max_batch: int = 256,
+                 fsync: bool = True):
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.batches_written = 0
+        self.writes_coalesced = 0
+        # key -> (seq, value), ordered by seq
+        self._pending = OrderedDict()
+        self._next_seq = 0
+        self._applied_seq = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._replay()
+        self._journal = open(journal_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="kv-write-behind", daemon=True)
+        self._thread.start()
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    key, value = json.loads(line)
+                except (json.JSONDecodeError, ValueError):
+                    # A torn last line from a crash mid-write
+                    continue
+                self._add(key, value)
+        if self._pending:
+            print(f"Replaying {len(self._pending)} journaled KV writes")
+
+    def _add(self, key, value):
+        self._next_seq += 1
+        if key in self._pending:
+            self.writes_coalesced += 1
+            del self._pending[key]
+        self._pending[key] = (self._next_seq, value)
+
+    def put_many(self, mapping: dict):
+        lines = "".join(json.dumps([key, value]) + "\n" for key, value in mapping.items())
+        with self._cond:
+            self._journal.write(lines)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            for key, value in mapping.items():
+                self._add(key, value)
+            self._cond.notify_all()
+
+    def get(self, key: str):
+        """
+        :return: The pending value of key, or None if nothing is waiting to be written
+        """
+        with self._cond:
+            entry = self._pending.get(key)
+            return None if entry is None else entry[1]
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Barrier: wait until every write made before this call has reached the backend
+
+        :return: False if the timeout expired first
+        """
+        with self._cond:
+            target = self._next_seq
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._applied_seq >= target, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'journal_bytes': self._journal.tell(),
+                'batches_written': self.batches_written,
+                'writes_coalesced': self.writes_coalesced,
+            }
+
+    def close(self, timeout: float = None):
+        """
+        Apply every pending write and stop the background writer
+        """
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._journal.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if self._stopping and not self._pending:
+                    return
+            # Let concurrent writers join this batch
+            time.sleep(self.flush_interval)
+            with self._cond:
+                batch = list(self._pending.items())[:self.max_batch]
+            items = [(key, value) for key, (_, value) in batch]
+            try:
+                results = get_session().set_many(items)
+            except Exception as e:
+                print(f"Write-behind batch failed: {e}")
+                results = [False] * len(items)
+
+            with self._cond:
+                for (key, (seq, _)), ok in zip(batch, results):
+                    # Keep the entry if it failed or was overwritten while the batch was in flight
+                    if ok and self._pending.get(key, (None,))[0] == seq:
+                        del self._pending[key]
+                self.batches_written += 1
+                self._applied_seq = next(iter(self._pending.values()))[0] - 1 if self._pending else self._next_seq
+                self._cond.notify_all()
+                try:
+                    self._compact()
+                except OSError as e:
+                    # The journal keeps its old content, which replays to the same values; retried after the next batch
+                    print(f"Write-behind journal compaction failed: {e}")
+            if not all(results):
+                time.sleep(min(1.0, self.flush_interval * 10))
+
+    def _compact(self):
+        # Called with the lock held
+        if not self._pending:
+            self._journal.truncate(0)
+            self._journal.seek(0)
+        elif self._journal.tell() > self.compact_bytes:
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, (_, value) in self._pending.items():
+                    f.write(json.dumps([key, value]) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # The old journal stays open for put_many() until the new one is in place
+            os.replace(tmp_path, self.journal_path)
+            journal, self._journal = self._journal, open(self.journal_path, "a", encoding="utf-8")
+            journal.close()
+
+
+def enable_write_behind(journal_path: str = "kv_journal.log", **options) -> WriteBehindQueue:
+    """
+    Switch set_kv/set_many to write-behind mode: they return once the write is journaled and
+    the backend is updated in batches. Reads in this process see the pending writes.
+    Call flush() before responding when the write must already be in ResilientDB.
+
+    :param options: Passed to WriteBehindQueue
+    """
+    global write_behind
+    if write_behind is None:
+        write_behind = WriteBehindQueue(journal_path, **options)
+    return write_behind
+
+
+def disable_write_behind(timeout: float = None):
+    """
+    Apply every pending write and go back to synchronous writes
+    """
+    global write_behind
+    queue = write_behind
+    if queue is not None:
+        queue.flush(timeout)
+        write_behind = None
+        queue.close(timeout)
+
+
+def flush(timeout: float = None) -> bool:
+    """
+    Wait until every write made so far has reached the backend. Returns at once without write-behind.
+    """
+    if write_behind is None:
+        return True
+    return write_behind.flush(timeout)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Threads used by the asyncio API. The native calls release the GIL, so these run in parallel,
+    one per pooled client.
+    """
+    global _executor
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=session_pool_size, thread_name_prefix="kv")
+    return _executor
+
+
+async def _run_in_executor(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def aget_kv(key: str, fresh: bool = False) -> str:
+    """
+    asyncio version of get_kv(), many of these can be awaited together with asyncio.gather()
+    """
+    return await _run_in_executor(get_kv, key, fresh=fresh)
+
+
+async def aset_kv(key: str, value: str):
+    """
+    asyncio version of set_kv()
+    """
+    return await _run_in_executor(set_kv, key, value)
+
+
+async def aget_many(keys, fresh: bool = False) -> dict:
+    """
+    asyncio version of get_many()
+    """
+    return await _run_in_executor(get_many, keys, fresh=fresh)
+
+
+# Compact value encoding
+#
+# Encoded values look like "\x1e" + CODEC_VERSION + KIND + fields joined by "\x1f". Field names are
+# implied by position, so they are not repeated in every record, and decoding is a single str.split().
+# Values are kept as text because the pybind layer passes them as UTF-8 strings.
+# Anything that does not start with the marker is read as legacy JSON.
+CODEC_VERSION = "1"
+FILE_RECORD = "F"
+CID_LIST = "L"
+DELETION_RECORD = "D"
+FAVORITES = "V"
+DIRECTORY_MANIFEST = "M"
+
+# Write values in the compact encoding instead of JSON. Both are always read, but nodes running older
+# code only read JSON and would take compact values for empty records. Turn this on, by setting
+# RESSHARE_KV_COMPACT=1 or assigning True, once every node has been upgraded to this version.
+compact_encoding = os.environ.get("RESSHARE_KV_COMPACT", "0") == "1"
+
+_CODEC_MARK = "\x1e"
+_FIELD_SEP = "\x1f"
+_FILE_RECORD_FIELDS = ('file_name', 'file_size', 'timestamp', 'segment')
+
+
+class _NotCompactable(Exception):
+    pass
+
+
+def _check_fields(fields):
+    for field in fields:
+        if not isinstance(field, str) or _CODEC_MARK in field or _FIELD_SEP in field:
+            raise _NotCompactable()
+    return fields
+
+
+def _encode_file_record(record):
+    if not set(record) <= set(_FILE_RECORD_FIELDS) or not isinstance(record.get('file_size', 0), int):
+        raise _NotCompactable()
+    return [str(record.get('file_name', '')), str(record.get('file_size', '')),
+            str(record.get('timestamp', '')), str(record.get('segment', ''))]
+
+
+def _decode_file_record(fields):
+    file_name, file_size, timestamp, segment = fields
+    record = {'file_name': file_name, 'file_size': int(file_size) if file_size else None}
+    if timestamp:
+        record['timestamp'] = timestamp
+    if segment:
+        record['segment'] = int(segment)
+    return record
+
+
+def _encode_deletion_record(record):
+    # {CID: {PEER_ID: deleted(bool)}}, normally a single CID
+    if len(record) > 1:
+        raise _NotCompactable()
+    fields = []
+    for cid, peers in record.items():
+        fields.append(cid)
+        for peer_id, deleted in peers.items():
+            fields += [peer_id, "1" if deleted else "0"]
+    return fields
+
+
+def _decode_deletion_record(fields):
+    if not fields or fields == [""]:
+        return {}
+    return {fields[0]: {fields[i]: fields[i + 1] == "1" for i in range(1, len(fields), 2)}}
+
+
+def _encode_favorites(favorites):
+    # {PEER_ID: {'nickname': NICKNAME, 'peer_name': PEER_NAME}}
+    fields = []
+    for peer_id, info in favorites.items():
+        if set(info) != {'nickname', 'peer_name'}:
+            raise _NotCompactable()
+        fields += [peer_id, info['nickname'], info['peer_name']]
+    return fields
+
+
+def _decode_favorites(fields):
+    if fields == [""]:
+        return {}
+    return {fields[i]: {'nickname': fields[i + 1], 'peer_name': fields[i + 2]} for i in range(0, len(fields), 3)}
+
+
+def _encode_directory_manifest(entries):
+    # [{'path': RELATIVE_PATH, 'cid': CID, 'size': BYTES}], one entry per file of a directory upload
+    fields = []
+    for entry in entries:
+        if set(entry) != {'path', 'cid', 'size'} or not isinstance(entry['size'], int):
+            raise _NotCompactable()
+        fields += [entry['path'], entry['cid'], str(entry['size'])]
+    return fields
+
+
+def _decode_directory_manifest(fields):
+    if fields == [""]:
+        return []
+    return [{'path': fields[i], 'cid': fields[i + 1], 'size': int(fields[i + 2])} for i in range(0, len(fields), 3)]
+
+
+_CODECS = {
+    FILE_RECORD: (_encode_file_record, _decode_file_record),
+    CID_LIST: (list, lambda fields: [] if fields == [""] else fields),
+    DELETION_RECORD: (_encode_deletion_record, _decode_deletion_record),
+    FAVORITES: (_encode_favorites, _decode_favorites),
+    DIRECTORY_MANIFEST: (_encode_directory_manifest, _decode_directory_manifest),
+}
+
+
+def encode_value(kind: str, value) -> str:
+    """
+    Serialize a record for storage, falling back to JSON when it does not fit the compact layout
+
+    :param kind: One of FILE_RECORD, CID_LIST, DELETION_RECORD, FAVORITES, DIRECTORY_MANIFEST
+    :param value: The python object to store
+    """
+    if compact_encoding:
+        try:
+            fields = _check_fields(_CODECS[kind][0](value))
+            return _CODEC_MARK + CODEC_VERSION + kind + _FIELD_SEP.join(fields)
+        except (_NotCompactable, AttributeError, TypeError):
+            pass
+    return json.dumps(value)
+
+
+def decode_value(kind: str, raw: str, default=None):
+    """
+    Parse a stored record written either by encode_value() or as legacy JSON
+
+    :param kind: The kind the value was encoded as
+    :param raw: The string read from the KV store
+    :param default: Returned for missing or unreadable values
+    """
+    if not raw:
+        return default
+    if raw[0] == _CODEC_MARK:
+        if raw[1:2] != CODEC_VERSION or raw[2:3] != kind:
+            print(f"Unsupported encoded value header {raw[1:3]!r}")
+            return default
+        try:
+            return _CODECS[kind][1](raw[3:].split(_FIELD_SEP))
+        except (ValueError, IndexError):
+            return default
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return default
+
 
+if os.environ.get("RESSHARE_KV_JOURNAL"):
+    enable_write_behind(os.environ["RESSHARE_KV_JOURNAL"])
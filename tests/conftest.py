@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import kv_service as kv
+import ipfs_cluster
+
+PEER_ID = "test-peer"
+
+# client.py asks the cluster for its peer id on import
+ipfs_cluster.get_my_peer_id = lambda: PEER_ID
+
+
+@pytest.fixture
+def kv_store():
+    """
+    A fresh in-process memory backend for every test
+    """
+    backend = kv.MemoryBackend()
+    kv.use_backend(backend)
+    return backend
@@ -0,0 +1,106 @@
+"""
+An in-process stand-in for the IPFS Cluster REST API and gateway, served by aiohttp on a background
+event loop. Used by the tests and by benchmarks/async_cluster_bench.py.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+
+from aiohttp import web
+
+PEER_ID = "fake-peer"
+
+
+class FakeCluster:
+    """
+    :param latency: Seconds every request waits before it is answered, like a remote cluster
+    pins maps CIDs to their status, requests records (method, path, query) of every request.
+    """
+
+    def __init__(self, latency=0.0):
+        self.pins = {}
+        self.blobs = {}
+        self.requests = []
+        self.app = make_app(self, latency)
+
+
+def make_app(state, latency):
+    app = web.Application(client_max_size=1024 ** 3)
+    pins, blobs, seen = state.pins, state.blobs, state.requests
+
+    @web.middleware
+    async def delay(request, handler):
+        seen.append((request.method, request.path, dict(request.query)))
+        if latency:
+            await asyncio.sleep(latency)
+        return await handler(request)
+
+    app.middlewares.append(delay)
+
+    async def add(request):
+        reader = await request.multipart()
+        part = await reader.next()
+        data = await part.read()
+        cid = "Qm" + hashlib.sha256(data).hexdigest()[:44]
+        blobs[cid] = data
+        pins[cid] = 'pinned'
+        return web.Response(text=json.dumps({'name': part.filename, 'cid': cid, 'size': len(data)}) + "\n")
+
+    async def pin(request):
+        cid = request.match_info['cid']
+        pins[cid] = 'pinned'
+        return web.json_response({'cid': cid, 'allocations': []})
+
+    async def list_pins(request):
+        return web.Response(text="".join(
+            json.dumps({'cid': cid, 'peer_map': {PEER_ID: {'status': pin_status}}}) + "\n"
+            for cid, pin_status in pins.items()))
+
+    async def status(request):
+        cid = request.match_info['cid']
+        return web.json_response({'cid': cid, 'peer_map': {PEER_ID: {'status': pins.get(cid, 'unpinned')}}})
+
+    async def unpin(request):
+        cid = request.match_info['cid']
+        if pins.pop(cid, None) is None:
+            return web.Response(status=404, text="not pinned")
+        return web.json_response({'cid': cid})
+
+    async def peers(request):
+        return web.Response(text=json.dumps({'id': PEER_ID, 'peername': 'fake'}) + "\n")
+
+    async def peer_id(request):
+        return web.json_response({'id': PEER_ID})
+
+    async def gateway(request):
+        cid = request.match_info['cid']
+        if cid not in blobs:
+            return web.Response(status=404)
+        return web.Response(body=blobs[cid])
+
+    app.router.add_post('/add', add)
+    app.router.add_post('/pins/{cid}', pin)
+    app.router.add_get('/pins', list_pins)
+    app.router.add_get('/pins/{cid}', status)
+    app.router.add_delete('/pins/{cid}', unpin)
+    app.router.add_get('/peers', peers)
+    app.router.add_get('/id', peer_id)
+    app.router.add_get('/ipfs/{cid}', gateway)
+    return app
+
+
+def start_server(cluster):
+    """
+    Serves a FakeCluster on a free local port from a daemon thread
+
+    :return: The base URL, ending in "/"
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(cluster.app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}/"
@@ -0,0 +1,56 @@
+import json
+
+import kv_service as kv
+import client
+
+
+def test_get_file_metadata_reads_unmigrated_peer(kv_store):
+    # A peer still in the legacy layout: one JSON blob under its id and no INDEX manifest
+    record = {'file_name': "report.pdf", 'file_size': 1234, 'timestamp': "2024-01-01"}
+    kv.set_kv("legacy-peer", json.dumps({"QmLegacy": record}))
+    kv.set_kv("QmLegacy", kv.encode_value(kv.DELETION_RECORD, {"QmLegacy": {"legacy-peer": False}}))
+
+    assert client.get_file_metadata("QmLegacy") == record
+
+
+def test_get_file_metadata_prefers_per_file_record(kv_store):
+    record = {'file_name': "new.txt", 'file_size': 5, 'timestamp': "2024-01-02"}
+    client._add_to_file_index("migrated-peer", "QmNew", record)
+    kv.set_kv("QmNew", kv.encode_value(kv.DELETION_RECORD, {"QmNew": {"migrated-peer": False}}))
+
+    assert client.get_file_metadata("QmNew") == record
+
+
+def test_get_file_metadata_unknown_cid(kv_store):
+    assert client.get_file_metadata("QmMissing") is None
+
+
+def test_interrupted_migration_keeps_every_cid(kv_store, monkeypatch):
+    legacy = {f"QmOld{i}": {'file_name': f"{i}.txt", 'file_size': i, 'timestamp': "2024-01-01"} for i in range(5)}
+    kv.set_kv("crash-peer", json.dumps(legacy))
+    for cid in legacy:
+        kv.set_kv(cid, kv.encode_value(kv.DELETION_RECORD, {cid: {"crash-peer": False}}))
+
+    # The process dies after the file records, before the segments are written
+    set_many = kv.set_many
+    calls = []
+
+    def crash_after_records(mapping):
+        calls.append(mapping)
+        if len(calls) == 2:
+            raise ConnectionError("crash")
+        return set_many(mapping)
+
+    monkeypatch.setattr(kv, "set_many", crash_after_records)
+    try:
+        client.migrate_legacy_file_structure("crash-peer")
+    except ConnectionError:
+        pass
+    monkeypatch.setattr(kv, "set_many", set_many)
+
+    assert client._load_file_structures(["crash-peer"])["crash-peer"] == legacy
+    assert client.get_file_metadata("QmOld3") == legacy["QmOld3"]
+
+    # Running it again completes the migration
+    assert client.migrate_legacy_file_structure("crash-peer")['segments'] == 1
+    assert client._load_file_structures(["crash-peer"])["crash-peer"] == legacy
@@ -0,0 +1,54 @@
+import pytest
+
+import client
+import controller
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-499", (0, 499)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    # Invalid headers are ignored, the whole file is sent
+    ("bytes=5-3", None),
+    ("bytes=-", None),
+    ("items=0-1", None),
+    ("bytes=0-1,5-6", None),
+])
+def test_parse_range(header, expected):
+    assert controller._parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=-5", 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        controller._parse_range(header, size)
+
+
+@pytest.fixture
+def served_file(monkeypatch):
+    content = bytes(range(256)) * 4
+    monkeypatch.setattr(client, "get_file_metadata", lambda cid: {'file_name': "data.bin", 'file_size': len(content)})
+    monkeypatch.setattr(client, "is_directory", lambda cid, metadata=None: False)
+    monkeypatch.setattr(client, "stream_file", lambda cid, start=0, end=None: iter([content[start:None if end is None else end + 1]]))
+    return content
+
+
+def test_download_range(served_file):
+    response = controller.app.test_client().get("/download/QmData", headers={'Range': "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 10-19/{len(served_file)}"
+    assert response.data == served_file[10:20]
+
+
+def test_download_invalid_range_sends_whole_file(served_file):
+    response = controller.app.test_client().get("/download/QmData", headers={'Range': "bytes=5-3"})
+    assert response.status_code == 200
+    assert response.data == served_file
+
+
+def test_download_unsatisfiable_range(served_file):
+    response = controller.app.test_client().get("/download/QmData", headers={'Range': f"bytes={len(served_file)}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{len(served_file)}"
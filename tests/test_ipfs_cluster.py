@@ -0,0 +1,33 @@
+import pytest
+
+import ipfs_cluster
+from fake_cluster import PEER_ID, FakeCluster, start_server
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    cluster = FakeCluster()
+    url = start_server(cluster)
+    monkeypatch.setattr(ipfs_cluster, "ipfs_cluster_api_url", url)
+    monkeypatch.setattr(ipfs_cluster, "ipfs_gateway_url", url)
+    return cluster
+
+
+def test_iter_pinned_files_filters_by_peer(fake, monkeypatch):
+    monkeypatch.setattr(ipfs_cluster, "_my_peer_id", PEER_ID)
+    fake.pins.update({"QmA": 'pinned', "QmB": 'pinning'})
+
+    assert [entry['cid'] for entry in ipfs_cluster.iter_pinned_files(peer=PEER_ID)] == ["QmA", "QmB"]
+    assert [entry['cid'] for entry in ipfs_cluster.iter_pinned_files(status='pinned', peer=PEER_ID)] == ["QmA"]
+    assert list(ipfs_cluster.iter_pinned_files(peer="other-peer")) == []
+
+
+def test_iter_pinned_files_looks_up_local_peer_once(fake, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(ipfs_cluster, "_my_peer_id", None)
+    monkeypatch.setattr(ipfs_cluster, "get_my_peer_id", lambda: lookups.append(1) or PEER_ID)
+
+    for _ in range(3):
+        list(ipfs_cluster.iter_pinned_files(peer=PEER_ID))
+    assert len(lookups) == 1
+    assert fake.requests[-1] == ("GET", "/pins", {'local': 'true'})
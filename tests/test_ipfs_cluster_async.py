@@ -0,0 +1,63 @@
+import asyncio
+import os
+
+import pytest
+
+import ipfs_cluster
+import ipfs_cluster_async
+from fake_cluster import PEER_ID, FakeCluster, start_server
+
+
+@pytest.fixture(scope="module")
+def fake():
+    cluster = FakeCluster()
+    url = start_server(cluster)
+    ipfs_cluster.ipfs_cluster_api_url = ipfs_cluster.ipfs_gateway_url = url
+    # Unpins are only recorded, the fake cluster has no GC endpoint
+    ipfs_cluster.get_gc_scheduler().debounce = 3600
+    return cluster
+
+
+def run(call):
+    async def with_client():
+        async with ipfs_cluster_async.AsyncClusterClient() as cluster:
+            return await call(cluster)
+    return asyncio.run(with_client())
+
+
+def test_add_status_and_download(fake, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(3 * 1024 * 1024))
+
+    async def calls(cluster):
+        cid = await cluster.add_file(str(path))
+        return cid, await cluster.status(cid), await cluster.download(cid, str(tmp_path / "out.bin"))
+
+    cid, status, result = run(calls)
+    assert cid is not None
+    assert status['peer_map'][PEER_ID]['status'] == 'pinned'
+    assert result['success']
+    assert (tmp_path / "out.bin").read_bytes() == path.read_bytes()
+
+
+def test_pin_sends_replication_factors(fake):
+    assert run(lambda cluster: cluster.pin("QmPin", 2, 3))
+    assert fake.requests[-1] == ("POST", "/pins/QmPin", ipfs_cluster._replication_params(2, 3))
+    assert run(lambda cluster: cluster.pin("QmPinDefault"))
+    assert fake.requests[-1] == ("POST", "/pins/QmPinDefault", {})
+
+
+def test_unpin(fake):
+    fake.pins["QmUnpin"] = 'pinned'
+    assert run(lambda cluster: cluster.unpin("QmUnpin"))
+    assert not run(lambda cluster: cluster.unpin("QmUnpin"))
+
+
+def test_peers_and_id(fake):
+    assert run(lambda cluster: cluster.peers())[0]['id'] == PEER_ID
+    assert run(lambda cluster: cluster.id()) == PEER_ID
+
+
+def test_download_missing_cid(fake, tmp_path):
+    result = run(lambda cluster: cluster.download("QmMissing", str(tmp_path / "missing")))
+    assert not result['success']
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+import kv_service as kv
+
+RECORDS = [
+    (kv.FILE_RECORD, {'file_name': "a.txt", 'file_size': 3, 'timestamp': "2024-01-01", 'segment': 0}),
+    (kv.CID_LIST, ["QmA", "QmB"]),
+    (kv.DELETION_RECORD, {"QmA": {"peer-1": False, "peer-2": True}}),
+    (kv.FAVORITES, {"peer-1": {'nickname': "one", 'peer_name': "node-1"}}),
+    (kv.DIRECTORY_MANIFEST, [{'path': "dir/a.txt", 'cid': "QmA", 'size': 3}]),
+]
+
+
+@pytest.mark.parametrize("kind, value", RECORDS)
+def test_json_is_written_by_default(kind, value):
+    # Nodes running older code only read JSON
+    assert json.loads(kv.encode_value(kind, value)) == value
+
+
+@pytest.mark.parametrize("kind, value", RECORDS)
+def test_compact_round_trip(monkeypatch, kind, value):
+    monkeypatch.setattr(kv, "compact_encoding", True)
+    encoded = kv.encode_value(kind, value)
+    assert encoded.startswith("\x1e")
+    assert kv.decode_value(kind, encoded) == value
@@ -0,0 +1,114 @@
+import hashlib
+
+# Import settings the CID is computed with. ipfs_cluster.add_file_to_cluster() sends the same settings
+# to /add, so compute_cid() returns the CID the cluster assigns.
+CHUNK_SIZE = 262144
+# Links per node of the balanced DAG, the go-ipfs / kubo default
+MAX_LINKS = 174
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_UNIXFS_FILE = 2
+_SHA2_256 = b"\x12\x20"
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _field_varint(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value)
+
+
+def _field_bytes(field: int, value: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def base58(data: bytes) -> str:
+    n = int.from_bytes(data, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 58)
+        out = _BASE58_ALPHABET[rem] + out
+    return "1" * (len(data) - len(data.lstrip(b"\0"))) + out
+
+
+def _leaf(data: bytes):
+    """
+    A dag-pb node holding one chunk as UnixFS file data
+
+    :return: (multihash, cumulative DAG size, file bytes)
+    """
+    unixfs = _field_varint(1, _UNIXFS_FILE)
+    if data:
+        unixfs += _field_bytes(2, data)
+    unixfs += _field_varint(3, len(data))
+    block = _field_bytes(1, unixfs)
+    return _SHA2_256 + hashlib.sha256(block).digest(), len(block), len(data)
+
+
+def _parent(children):
+    """
+    A dag-pb node linking to children, dag-pb puts the links before the data.
+
+    :param children: [(multihash, cumulative DAG size, file bytes)]
+    """
+    file_size = sum(child[2] for child in children)
+    unixfs = _field_varint(1, _UNIXFS_FILE) + _field_varint(3, file_size)
+    unixfs += b"".join(_field_varint(4, child[2]) for child in children)
+    links = b"".join(
+        _field_bytes(2, _field_bytes(1, multihash) + _field_bytes(2, b"") + _field_varint(3, dag_size))
+        for multihash, dag_size, _ in children
+    )
+    block = links + _field_bytes(1, unixfs)
+    return (_SHA2_256 + hashlib.sha256(block).digest(),
+            len(block) + sum(child[1] for child in children), file_size)
+
+
+def compute_cid(file_path: str) -> str:
+    """
+    Computes the CIDv0 that `ipfs add` gives the file with a fixed-size chunker of CHUNK_SIZE bytes,
+    the balanced layout with MAX_LINKS links per node and no raw leaves.
+    The file is read once in CHUNK_SIZE pieces, at most MAX_LINKS nodes per tree level are held.
+
+    :param file_path: The path to the file.
+    :return: The base58 CIDv0, such as "Qm..."
+    """
+    # levels[i] holds the finished nodes of depth i that do not have a parent yet
+    levels = [[]]
+    # Whether a level already passed a full group to its parent, then its last group needs one too
+    flushed = [False]
+
+    def add(depth, node):
+        if len(levels[depth]) == MAX_LINKS:
+            if depth + 1 == len(levels):
+                levels.append([])
+                flushed.append(False)
+            add(depth + 1, _parent(levels[depth]))
+            levels[depth] = []
+            flushed[depth] = True
+        levels[depth].append(node)
+
+    with open(file_path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        add(0, _leaf(chunk))
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            add(0, _leaf(chunk))
+
+    depth = 0
+    while depth + 1 < len(levels) or flushed[depth] or len(levels[depth]) > 1:
+        if depth + 1 == len(levels):
+            levels.append([])
+            flushed.append(False)
+        if levels[depth]:
+            add(depth + 1, _parent(levels[depth]))
+            levels[depth] = []
+        depth += 1
+    return base58(levels[depth][0][0])
@@ -0,0 +1,144 @@
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Threads running uploads
+worker_count = int(os.environ.get("RESSHARE_UPLOAD_WORKERS", "4"))
+
+# Uploads waiting for a worker before submit() refuses more, see QueueFull
+max_queued = int(os.environ.get("RESSHARE_UPLOAD_QUEUE", "64"))
+
+# Seconds submit() waits for room in a full queue before raising QueueFull, 0 to refuse right away
+queue_wait = float(os.environ.get("RESSHARE_UPLOAD_QUEUE_WAIT", "0"))
+
+# Seconds a finished job stays visible to status polling
+job_ttl = 3600.0
+
+# Stages a job does not leave
+_FINAL_STAGES = ('indexed', 'partial', 'failed')
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """
+    Raised by submit() when max_queued uploads are already waiting
+    """
+
+
+class UploadJobQueue:
+    """
+    Runs uploads on a fixed pool of worker threads so HTTP requests can return before the upload ends.
+    A job goes through the stages received, added (the cluster returned a CID) and indexed (the KV
+    records are written), or ends as failed with an error message. A batch job where only some
+    files were indexed ends as partial.
+
+    :param workers: Number of worker threads
+    :param max_queued_jobs: Jobs that may wait for a worker
+    :param wait: Seconds submit() waits for room in a full queue
+    """
+
+    def __init__(self, workers: int = None, max_queued_jobs: int = None, wait: float = None):
+        self.workers = workers or worker_count
+        self.max_queued = max_queued_jobs or max_queued
+        self.wait = queue_wait if wait is None else wait
+        self._pending = queue.Queue(maxsize=self.max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"upload-worker-{i}", daemon=True).start()
+
+    def submit(self, upload, description: dict = None, cleanup=None) -> dict:
+        """
+        Queues upload(on_stage=...) to run on a worker. upload calls on_stage(stage, **fields) as it progresses,
+        the fields (such as cid) are copied into the job status. It returns a false value if the upload failed.
+
+        :param upload: The upload to run, such as functools.partial(client.upload_file, path)
+        :param description: Extra fields shown in the job status, such as the file name
+        :param cleanup: Called once the job has finished or could not be queued, such as removing a temp file
+        :return: The job status, see get()
+        :raises QueueFull: If the queue stayed full for wait seconds
+        """
+        self._prune()
+        now = time.time()
+        job = dict(description or {}, id=uuid.uuid4().hex, stage='received', cid=None, error=None,
+                   created=now, updated=now)
+        with self._lock:
+            self._jobs[job['id']] = job
+        try:
+            self._pending.put((job['id'], upload, cleanup), block=self.wait > 0, timeout=self.wait or None)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job['id']]
+            if cleanup is not None:
+                cleanup()
+            raise QueueFull(f"{self.max_queued} uploads are already waiting")
+        return dict(job)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, updated=time.time())
+
+    def _run(self):
+        while True:
+            job_id, upload, cleanup = self._pending.get()
+            try:
+                result = upload(on_stage=lambda stage, **fields: self._update(job_id, stage=stage, **fields))
+                if not result:
+                    self._update(job_id, stage='failed', error="Failed to add file to IPFS Cluster")
+            except Exception as e:
+                self._update(job_id, stage='failed', error=str(e))
+            finally:
+                if cleanup is not None:
+                    try:
+                        cleanup()
+                    except OSError as e:
+                        print(f"Upload job {job_id} cleanup failed: {e}")
+
+    def _prune(self):
+        expired = time.time() - job_ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job['stage'] in _FINAL_STAGES and job['updated'] < expired]:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str):
+        """
+        :return: {'id', 'stage', 'cid', 'error', 'created', 'updated', ...}, or None for an unknown job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def full(self) -> bool:
+        """
+        Whether submit() would have to wait or refuse right now
+        """
+        return self._pending.full()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {}
+            for job in self._jobs.values():
+                stages[job['stage']] = stages.get(job['stage'], 0) + 1
+        return {
+            'workers': self.workers,
+            'queued': self._pending.qsize(),
+            'max_queued': self.max_queued,
+            'queue_wait': self.wait,
+            'stages': stages,
+        }
+
+
+def get_queue() -> UploadJobQueue:
+    """
+    The shared UploadJobQueue, its workers start on first use
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = UploadJobQueue()
+        return _queue